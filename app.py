@@ -1,7 +1,9 @@
+import os
+import uuid
 import streamlit as st
-import pandas as pd
-from streamlit_folium import st_folium
+from datetime import time
 import main
+import jobs
 
 # ページ設定
 st.set_page_config(page_title="送迎ルート自動作成", layout="wide")
@@ -17,6 +19,8 @@ if 'calculated' not in st.session_state:
     st.session_state.total_time = 0
     st.session_state.map_obj = None
     st.session_state.df_result = None
+    # 共有ジョブの待ち手を区別するためのセッション ID
+    st.session_state.session_id = uuid.uuid4().hex
 
 # ==========================================
 # サイドバー: 設定パネル
@@ -29,10 +33,21 @@ capacity = st.sidebar.number_input("車の定員 (全員共通)", min_value=1, m
 max_trips = st.sidebar.selectbox("最大何回まで往復可能？", [1, 2, 3], index=1)
 
 st.sidebar.subheader("2. 時間の設定")
-start_time_obj = st.sidebar.time_input("出発時間 (拠点)", value=pd.to_datetime("18:00").time())
-end_time_obj = st.sidebar.time_input("送迎完了リミット", value=pd.to_datetime("19:00").time())
+start_time_obj = st.sidebar.time_input("出発時間 (拠点)", value=time(18, 0))
+end_time_obj = st.sidebar.time_input("送迎完了リミット", value=time(19, 0))
 service_time = st.sidebar.number_input("1人あたりの乗降時間(分)", min_value=1, max_value=10, value=5)
 
+st.sidebar.subheader("3. 計算モード")
+warm_start = st.sidebar.checkbox("前回のルートを基に再最適化 (高速・ルートを大きく変えない)", value=False)
+portfolio = st.sidebar.checkbox("マルチコアで複数の探索を並列実行 (ポートフォリオ)", value=False)
+decompose = st.sidebar.checkbox("大規模名簿: 地域ごとに分割して計算 (100人以上向け)", value=False)
+has_road_graph = os.path.exists(main.ROAD_GRAPH_PATH)
+road_graph = st.sidebar.checkbox(
+    "道路データ (OSM) で移動時間・経路を計算 (通信なし)", value=has_road_graph, disabled=not has_road_graph,
+    help=f"{main.ROAD_GRAPH_PATH} を python road_graph.py <地域>.osm で作成すると使えます")
+sparse_matrix = st.sidebar.checkbox(f"移動時間は近い {main.SPARSE_NEIGHBORS} 地点だけ API で取得 (残りは推定・API 節約)", value=False)
+light_map = st.sidebar.checkbox("地図を軽量表示 (経路を簡略化・同じ結果は保存済みの地図を使う)", value=True)
+
 start_minutes = start_time_obj.hour * 60 + start_time_obj.minute
 end_minutes = end_time_obj.hour * 60 + end_time_obj.minute
 
@@ -42,35 +57,116 @@ config = {
     'max_trips': max_trips,
     'start_minutes': start_minutes,
     'end_minutes': end_minutes,
-    'service_time': service_time
+    'service_time': service_time,
+    'warm_start': warm_start,
+    'portfolio': portfolio,
+    'decompose': decompose,
+    'sparse_neighbors': main.SPARSE_NEIGHBORS if sparse_matrix else 0,
+    'road_graph': main.ROAD_GRAPH_PATH if road_graph else None,
+    'light_map': light_map
 }
 
 # ==========================================
 # メイン画面 (実行ロジック)
 # ==========================================
 
+@st.cache_resource
+def get_job_manager():
+    # 全セッションで共有: 同じ名簿・設定の計算は1回だけ実行される
+    return jobs.JobManager()
+
+job_manager = get_job_manager()
+
+@st.fragment(run_every=1.0)
+def show_job_progress(job):
+    if job.finished:
+        st.rerun()
+    job.subscribe(st.session_state.session_id)  # まだ待っていることを知らせる (閉じたタブは一定時間で外れる)
+    best = job.best_objective()
+    status_text = "待機中" if job.status == 'queued' else "計算中"
+    st.info(f"⏳ {status_text}... 経過 {job.elapsed():.0f} 秒 / 現在の最良スコア: {best if best is not None else '-'}")
+    if len(job.progress) > 1:
+        import pandas as pd
+        st.line_chart(pd.DataFrame(job.progress, columns=["経過秒", "スコア"]).set_index("経過秒"))
+    if st.button("計算を中止する", key=f"cancel_{job.key}"):
+        if job.cancel(st.session_state.session_id):
+            st.warning("中止を受け付けました (まもなく停止し、その時点で最良のルートを表示します)")
+        else:
+            # 同じ条件の計算を他の利用者も待っているので、計算は止めずにこの画面だけ待つのをやめる
+            st.toast("同じ計算を他の利用者も待っているため、計算は続けたままこの画面での待機をやめました")
+            st.session_state.job_key = None
+            st.rerun()
+
 if start_minutes >= end_minutes:
     st.error("⚠️ エラー: 終了時間は開始時間より後に設定してください。")
 else:
     # --- 計算実行ボタン ---
     if st.sidebar.button("ルート計算を開始する", type="primary"):
-        with st.spinner("AIがルートを計算中です... (最大300秒かかります)"):
-            
-            # 計算実行
-            success, total_time, m, df = main.solve_vrp(config)
-            
+        telemetry = main.RunTelemetry()
+        with telemetry.phase('roster_read'):
+            roster, changed = main.read_input_sheet("Input")
+        if not roster[0]:
+            st.error("❌ スプレッドシートからデータを読み込めませんでした。")
+        else:
+            key = jobs.job_key(roster, config)
+            # Input シートも設定も前回と同じなら、計算済みの結果をそのまま使う
+            if not changed and job_manager.get(key) is not None:
+                st.toast("Input シートに変更がないため、前回の計算結果を表示します")
+            job_manager.submit(key, main.solve_vrp, config, roster, telemetry=telemetry,
+                               subscriber=st.session_state.session_id)
+            st.session_state.job_key = key
+            st.session_state.calculated = False
+
+    # --- バックグラウンド計算の状況 ---
+    job = job_manager.get(st.session_state.get('job_key'))
+    if job is not None and not st.session_state.calculated:
+        if not job.finished:
+            show_job_progress(job)
+        elif job.status == 'failed':
+            st.error(f"❌ 計算中にエラーが発生しました: {job.error}")
+            st.session_state.job_key = None
+        else:
+            success, total_time, m, df = job.result
             if success:
                 st.session_state.calculated = True
                 st.session_state.total_time = total_time
                 st.session_state.map_obj = m
                 st.session_state.df_result = df
+                st.session_state.telemetry = job.telemetry.to_dict()
+                if job.status == 'cancelled':
+                    st.warning("⚠️ 計算を中止しました。中止時点で最良のルートを表示します。")
+            elif job.status == 'cancelled':
+                st.warning("⚠️ 計算を中止しました。中止時点でルートはまだ見つかっていませんでした。")
+                st.session_state.job_key = None
             else:
-                st.session_state.calculated = False
-                st.error("❌ 解が見つかりませんでした。条件（時間や台数）を緩めて再試行してください。")
+                solver = job.telemetry.to_dict()['solver']
+                if solver.get('problems'):
+                    # 探索する前に分かった解けない理由 (定員不足・直行でも間に合わない児童)
+                    st.error("❌ この条件では解けません。次の点を見直してください:\n"
+                             + "\n".join(f"- {problem}" for problem in solver['problems']))
+                elif solver.get('status') == 'no_solution':
+                    st.error(f"❌ 最大 {solver['max_trips']} 便でも解が見つかりませんでした。"
+                             "条件（時間や台数・便数）を緩めて再試行してください。")
+                else:
+                    st.error("❌ 解が見つかりませんでした。条件（時間や台数）を緩めて再試行してください。")
+                st.session_state.job_key = None
 
     # --- 結果の表示 ---
     if st.session_state.calculated:
         st.success(f"✅ 計算完了！ (最適化スコア: {st.session_state.total_time})")
+
+        record = st.session_state.get('telemetry')
+        if record:
+            with st.expander("⏱️ 処理時間の内訳・API 呼び出し・探索の統計"):
+                phases = record['phases']
+                st.write(f"合計 {record['wall_s']:.1f} 秒 / " + " / ".join(f"{name} {seconds:.2f} 秒" for name, seconds in phases.items()))
+                st.bar_chart(phases, horizontal=True)
+                for service, stats in record['http'].items():
+                    st.write(f"{service}: {stats['calls']} 回 (失敗 {stats['errors']}) / 中央値 {stats['p50_s']:.2f} 秒 / 95% {stats['p95_s']:.2f} 秒")
+                solver = record['solver']
+                if solver.get('objective_history'):
+                    st.line_chart({"スコア": {t: obj for t, obj in solver['objective_history']}})
+                st.json(record, expanded=False)
         
         m = st.session_state.map_obj
         df = st.session_state.df_result
@@ -78,8 +174,16 @@ else:
         tab1, tab2 = st.tabs(["🗺️ 地図で確認", "📋 運行表で確認"])
         
         with tab1:
-            # ★修正箇所: returned_objects=[] を追加して再描画ループを防ぐ
-            st_folium(m, width=1000, height=600, returned_objects=[])
+            if isinstance(m, str):
+                # 軽量表示: 作成済みの HTML をそのまま渡す (再実行のたびに folium で組み立て直さない)
+                import streamlit.components.v1 as components
+                components.html(m, width=1000, height=600)
+                st.caption(f"地図データ: {len(m.encode('utf-8')) / 1024:.0f} KB (経路を簡略化して車両ごとにまとめています)")
+            else:
+                # streamlit_folium (folium) は読み込みが重いため、地図を表示する時だけ読み込む
+                from streamlit_folium import st_folium
+                # ★修正箇所: returned_objects=[] を追加して再描画ループを防ぐ
+                st_folium(m, width=1000, height=600, returned_objects=[])
             
         with tab2:
             # 警告回避のために use_container_width=True を維持 (Streamlitのバージョンによっては width='stretch' 推奨)
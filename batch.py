@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import main
+import jobs
+
+# ==========================================
+# 複数拠点・複数日のルートを一括計算する (Streamlit 不要)
+#   python batch.py rosters/*.csv --out out/ --workers 4 --time-limit 60
+#   python batch.py sheet:<スプレッドシートID>:Input --out out/
+# ==========================================
+
+def _name_candidates(source):
+    # 短い順の名前の候補。ファイルは拡張子を除いた名前に親ディレクトリを1つずつ足していく
+    if source.startswith("sheet:"):
+        _, spreadsheet_id, *rest = source.split(":")
+        sheet = rest[0] if rest else 'Input'
+        return [f"sheet-{spreadsheet_id[:8]}-{sheet}", f"sheet-{spreadsheet_id}-{sheet}"]
+    parts = [part for part in os.path.splitext(os.path.abspath(source))[0].split(os.sep) if part]
+    return ["-".join(parts[-depth:]) for depth in range(1, len(parts) + 1)]
+
+def instance_names(sources):
+    # {入力: インスタンス名}。名前は出力先ディレクトリと --config の上書きのキーになるので、
+    # 別の拠点の同名ファイル (siteA/mon.csv と siteB/mon.csv) は親ディレクトリを含めて区別する
+    candidates = {source: _name_candidates(source) for source in sources}
+    level = dict.fromkeys(sources, 0)
+    while True:
+        by_name = {}
+        for source in sources:
+            by_name.setdefault(candidates[source][level[source]], []).append(source)
+        collisions = [group for group in by_name.values() if len(group) > 1]
+        if not collisions:
+            return {source: candidates[source][level[source]] for source in sources}
+        for group in collisions:
+            for source in group:
+                if level[source] + 1 >= len(candidates[source]):
+                    raise ValueError(f"インスタンス名が重複します (同じ入力が2回指定されています): {', '.join(group)}")
+                level[source] += 1
+
+def load_roster(source):
+    # "sheet:<ID>[:<シート名>]" は Google スプレッドシート、それ以外は CSV / Parquet ファイル
+    if source.startswith("sheet:"):
+        _, spreadsheet_id, *rest = source.split(":")
+        return main.get_input_from_sheet(rest[0] if rest else "Input", spreadsheet_id=spreadsheet_id)
+    return main.read_roster_file(source)
+
+def run_job(source, name, config, out_dir, api_key, render_map, force=False):
+    # ワーカープロセスで1インスタンスを解き、運行表と地図を out_dir/name に書き出す
+    # 名簿と設定が前回の出力時と同じなら計算を省く (force=True で再計算)
+    job_dir = os.path.join(out_dir, name)
+    os.makedirs(job_dir, exist_ok=True)
+    started = time.monotonic()
+    record = {'name': name, 'source': source, 'solved': False, 'skipped': False, 'objective': None,
+              'students': 0, 'solver_seconds': 0.0, 'error': None}
+    telemetry = main.RunTelemetry(run_id=name)
+    key_path = os.path.join(job_dir, "input_key.txt")
+    record_path = os.path.join(job_dir, "record.json")
+
+    with open(os.path.join(job_dir, "solve.log"), "a", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        print(f"===== {time.strftime('%Y-%m-%d %H:%M:%S')} =====")
+        try:
+            with telemetry.phase('roster_read'):
+                roster = load_roster(source)
+            record['students'] = max(0, len(roster[0]) - 1)
+            key = jobs.job_key(roster, dict(config, render_map=render_map))
+            previous = _load_previous(key_path, record_path)
+            if previous and previous['key'] == key and previous['record']['solved'] and not force:
+                print("名簿・設定とも前回から変更がないため、計算を省きます")
+                record.update({'solved': True, 'skipped': True, 'objective': previous['record']['objective']})
+                data = None
+            else:
+                data = main.create_data_model(config, roster=roster, api_key=api_key, telemetry=telemetry)
+            if data:
+                solve_started = time.monotonic()
+                result = main.solve_data_model(data, config, telemetry=telemetry)
+                record['solver_seconds'] = round(time.monotonic() - solve_started, 2)
+                if result:
+                    total_time, routes = result
+                    record.update({'solved': True, 'objective': total_time})
+                    df = main.create_schedule_df(data, routes, telemetry)
+                    df.to_csv(os.path.join(job_dir, "schedule.csv"), index=False, encoding="utf-8_sig")
+                    if render_map and config.get('light_map'):
+                        html = main.render_map_html(data, routes, telemetry)
+                        with open(os.path.join(job_dir, "map.html"), "w", encoding="utf-8") as f:
+                            f.write(html)
+                        record['map_bytes'] = len(html.encode('utf-8'))
+                    elif render_map:
+                        main.create_map_object(data, routes, telemetry).save(os.path.join(job_dir, "map.html"))
+                with open(key_path, "w", encoding="utf-8") as f:
+                    f.write(key)
+                with open(record_path, "w", encoding="utf-8") as f:
+                    json.dump(record, f, ensure_ascii=False)
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+            print(f"エラー: {record['error']}")
+
+    record['wall_seconds'] = round(time.monotonic() - started, 2)
+    record['phases'] = telemetry.to_dict()['phases']
+    telemetry.save(os.path.join(job_dir, "telemetry.jsonl"))
+    return record
+
+def _load_previous(key_path, record_path):
+    try:
+        with open(key_path, encoding="utf-8") as f:
+            key = f.read().strip()
+        with open(record_path, encoding="utf-8") as f:
+            return {'key': key, 'record': json.load(f)}
+    except (OSError, ValueError):
+        return None
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="送迎ルートの一括計算")
+    parser.add_argument("sources", nargs="+", help="CSV / Parquet ファイル、または sheet:<スプレッドシートID>[:<シート名>]")
+    parser.add_argument("--out", default="batch_output", help="出力先ディレクトリ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--time-limit", type=int, default=60, help="1インスタンスあたりの探索時間 (秒)")
+    parser.add_argument("--num-cars", type=int, default=5)
+    parser.add_argument("--capacity", type=int, default=5)
+    parser.add_argument("--max-trips", type=int, default=2)
+    parser.add_argument("--start", default="18:00", help="出発時間 (拠点)")
+    parser.add_argument("--end", default="19:00", help="送迎完了リミット")
+    parser.add_argument("--service-time", type=int, default=5)
+    parser.add_argument("--config", help="インスタンス名ごとの設定上書き (JSON: {名前: {num_cars: ...}})。"
+                                         "名前はファイル名 (同名のファイルがあれば 親ディレクトリ-ファイル名)")
+    parser.add_argument("--offline", action="store_true", help="Google Maps API を使わず簡易計算で行列を作る")
+    parser.add_argument("--no-map", action="store_true", help="地図 (OSRM 経路) を出力しない")
+    parser.add_argument("--force", action="store_true", help="名簿・設定が前回と同じでも再計算する")
+    parser.add_argument("--decompose", action="store_true", help="地域ごとに分割して解く (大規模名簿向け)")
+    parser.add_argument("--light-map", action="store_true", help="地図を車両ごとの簡略化した GeoJSON で出力する (軽量)")
+    parser.add_argument("--road-graph", help="道路グラフ (road_graph.py で作成した .npz) で移動時間・経路を求める")
+    parser.add_argument("--sparse-k", type=int, default=0,
+                        help="各地点の近い k 地点と拠点との往復だけを API で取得し、残りは推定する (0: 全要素を取得)")
+    args = parser.parse_args(argv)
+    try:
+        names = instance_names(args.sources)
+    except ValueError as e:
+        parser.error(str(e))
+
+    base_config = {
+        'num_cars': args.num_cars,
+        'capacity': args.capacity,
+        'max_trips': args.max_trips,
+        'start_minutes': main.time_str_to_minutes(args.start, 18 * 60),
+        'end_minutes': main.time_str_to_minutes(args.end, 19 * 60),
+        'service_time': args.service_time,
+        'time_limit': args.time_limit,
+        'decompose': args.decompose,
+        'sparse_neighbors': args.sparse_k,
+        'road_graph': args.road_graph,
+        'light_map': args.light_map,
+        # インスタンス単位で並列に解くので、分割計算のプロセス数はコア数の残りに収める
+        'decompose_workers': max(1, (os.cpu_count() or 1) // args.workers),
+    }
+    overrides = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            overrides = json.load(f)
+    api_key = "" if args.offline else main.load_google_maps_api_key()
+    os.makedirs(args.out, exist_ok=True)
+
+    print(f"{len(args.sources)} インスタンスを {args.workers} プロセスで計算します (各 {args.time_limit} 秒)")
+    started = time.monotonic()
+    records = []
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {}
+        for source in args.sources:
+            config = dict(base_config, **overrides.get(names[source], {}))
+            futures[pool.submit(run_job, source, names[source], config, args.out, api_key, not args.no_map,
+                                args.force)] = source
+        for future in as_completed(futures):
+            record = future.result()
+            records.append(record)
+            status = "変更なし (前回の結果)" if record['skipped'] else "OK" if record['solved'] else (record['error'] or "解なし")
+            print(f"  {record['name']}: {status} (目的値 {record['objective']}, 探索 {record['solver_seconds']} 秒, 計 {record['wall_seconds']} 秒)")
+    elapsed = time.monotonic() - started
+
+    solver_seconds = sum(record['solver_seconds'] for record in records)
+    solved = sum(record['solved'] for record in records)
+    summary = {
+        'instances': len(records),
+        'solved': solved,
+        'wall_seconds': round(elapsed, 2),
+        'instances_per_minute': round(len(records) / elapsed * 60, 2) if elapsed > 0 else None,
+        'total_solver_seconds': round(solver_seconds, 2),
+        'records': sorted(records, key=lambda record: record['name']),
+    }
+    with open(os.path.join(args.out, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=1)
+
+    print(f"\n完了: {solved}/{len(records)} 件で解を発見 / 経過 {elapsed:.1f} 秒 / "
+          f"{summary['instances_per_minute']} 件/分 / 探索合計 {solver_seconds:.1f} 秒")
+    print(f"結果は {args.out} に保存しました")
+    return 0 if solved == len(records) else 1
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
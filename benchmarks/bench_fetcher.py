@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+import instances
+
+# ==========================================
+# Distance Matrix の取得: 以前の逐次取得と matrix_fetcher の並列取得の比較
+# Google Maps の代わりにローカルの偽サーバー (応答の遅れ・一時的なエラー・壊れた応答を再現) を使う
+#   python benchmarks/bench_fetcher.py --stops 60 --latency 0.2 --error-rate 0.1
+# ==========================================
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # server.latency 秒待ってから、直線距離 20 km/h の所要時間を Distance Matrix API の形で返す。
+    # server.error_rate の割合で HTTP 500 / OVER_QUERY_LIMIT (rows なし) / status OK で rows なし のどれかを返す
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlparse(self.path).query)
+        origins = [tuple(map(float, p.split(','))) for p in query['origins'][0].split('|')]
+        dests = [tuple(map(float, p.split(','))) for p in query['destinations'][0].split('|')]
+        time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            server.elements += len(origins) * len(dests)
+            roll = server.rng.random()
+            kind = server.rng.randrange(3)
+        if roll < server.error_rate and kind == 0:
+            self.send_response(500)
+            self.end_headers()
+            return
+        if roll < server.error_rate and kind == 1:
+            body = {'status': 'OVER_QUERY_LIMIT', 'error_message': 'You have exceeded your rate-limit.'}
+        elif roll < server.error_rate:
+            body = {'status': 'OK'}
+        else:
+            body = {'status': 'OK', 'rows': [
+                {'elements': [{'status': 'OK', 'duration': {'value': stub_seconds(a, b)}} for b in dests]}
+                for a in origins
+            ]}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_seconds(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return round(2 * 6371.0 * math.asin(math.sqrt(h)) / 20.0 * 3600)
+
+
+@contextlib.contextmanager
+def stub_server(latency, error_rate, seed):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.latency, server.error_rate = latency, error_rate
+    server.rng, server.lock = random.Random(seed), threading.Lock()
+    server.requests = server.elements = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_address[1]}/maps/api/distancematrix/json"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def legacy_fetch(locations, url):
+    # 以前の取得方法: 出発地1つ × 行き先 25 地点ずつを順番に、再試行なし (失敗は 9999)
+    matrix = []
+    for origin in locations:
+        row = []
+        for j in range(0, len(locations), 25):
+            chunk = locations[j : j + 25]
+            params = {'units': 'metric', 'origins': f"{origin[0]},{origin[1]}",
+                      'destinations': "|".join(f"{loc[0]},{loc[1]}" for loc in chunk), 'key': 'bench'}
+            try:
+                data = requests.get(url, params=params, timeout=10).json()
+                if data['status'] != 'OK':
+                    row.extend([9999] * len(chunk))
+                    continue
+                row.extend(round(e['duration']['value'] / 60) if e['status'] == 'OK' else 9999
+                           for e in data['rows'][0]['elements'])
+            except Exception:
+                row.extend([9999] * len(chunk))
+        matrix.append(row)
+    return matrix
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stops', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.2, help='偽サーバーの応答の遅れ (秒)')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='一時的なエラー・壊れた応答の割合')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--qps', type=float, default=20)
+    parser.add_argument('--skip-legacy', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from matrix_fetcher import DistanceMatrixFetcher
+
+    roster = instances.generate_roster(args.stops - 1, 'uniform', 0.0, seed=args.seed)
+    locations = [instances.DEPOT] + roster[2]
+    n = len(locations)
+    cells = [(i, j) for i in range(n) for j in range(n) if i != j]
+    truth = {(i, j): round(stub_seconds(locations[i], locations[j]) / 60) for i, j in cells}
+    print(f"{n} 地点 ({len(cells)} 要素)  応答の遅れ {args.latency}s  エラー率 {args.error_rate:.0%}")
+
+    if not args.skip_legacy:
+        with stub_server(args.latency, args.error_rate, args.seed) as (server, url):
+            t0 = time.perf_counter()
+            matrix = legacy_fetch(locations, url)
+            seconds = time.perf_counter() - t0
+        failed = sum(matrix[i][j] == 9999 for i, j in cells)
+        print(f"逐次 (以前)  : {server.requests:>4} リクエスト {seconds:6.1f}s  失敗 {failed} 要素 (9999 のまま)")
+
+    with stub_server(args.latency, args.error_rate, args.seed) as (server, url):
+        fetcher = DistanceMatrixFetcher("bench", base_url=url, max_workers=args.workers, qps=args.qps)
+        t0 = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            report = fetcher.fetch(locations, cells)
+        seconds = time.perf_counter() - t0
+    wrong = sum(report.durations[c] != truth[c] for c in report.durations)
+    print(f"並列 (fetcher): {server.requests:>4} リクエスト {seconds:6.1f}s  失敗 {len(report.failed)} 要素  "
+          f"再試行 {report.retries} 回  値の不一致 {wrong}")
+
+
+if __name__ == '__main__':
+    main_cli()
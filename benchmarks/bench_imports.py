@@ -0,0 +1,69 @@
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+# ==========================================
+# 起動時の import 時間 (python -X importtime) の計測
+#   python benchmarks/bench_imports.py
+#   python benchmarks/bench_imports.py --root /path/to/old-checkout   # 別の版と比較
+# ==========================================
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 経路ごとに最初に実行される import
+SCENARIOS = {
+    'main': "import main",
+    'solver-only': "import solver",
+    'batch': "import batch",
+    'app': "import streamlit, main, jobs",
+}
+HEAVY_MODULES = ['folium', 'pandas', 'gspread', 'google.oauth2', 'streamlit', 'ortools', 'requests', 'numpy']
+
+
+def measure(root, code):
+    # 戻り値: (合計秒, 読み込まれた重いモジュール)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {root!r}); {code}"],
+        capture_output=True, text=True, cwd=root,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    total_us = 0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        module = name.strip()
+        if name[:len(name) - len(name.lstrip())] == " ":
+            # 字下げ1つ = 最上位の import (子の時間は cumulative に含まれる)
+            total_us += int(cumulative)
+        for heavy in HEAVY_MODULES:
+            if module == heavy:
+                loaded.add(heavy)
+    return total_us / 1e6, sorted(loaded, key=HEAVY_MODULES.index)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=ROOT, help='計測するチェックアウトのディレクトリ')
+    parser.add_argument('--repeat', type=int, default=5, help='各経路の計測回数 (中央値を表示)')
+    args = parser.parse_args()
+
+    # インタプリタ起動時の import (site 等) は差し引く
+    startup = statistics.median(measure(args.root, "pass")[0] for _ in range(args.repeat))
+    print(f"{args.root} の import 時間 ({args.repeat} 回の中央値)")
+    for name, code in SCENARIOS.items():
+        try:
+            runs = [measure(args.root, code) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{name:<12} 計測できません: {e}")
+            continue
+        seconds = statistics.median(run[0] for run in runs) - startup
+        print(f"{name:<12} {seconds:>6.3f}s  読み込み: {', '.join(runs[-1][1]) or '-'}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import argparse
+import contextlib
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import instances
+from bench_road_graph import write_grid_osm
+
+# ==========================================
+# 地図の描画: 従来の地図 (区間ごとの PolyLine・Marker) と軽量な地図 (車両ごとの GeoJSON) の比較
+# 経路は合成の街の道路グラフからたどる (OSRM に問い合わせない)
+#   python benchmarks/bench_map_render.py --students 100 200 --time-limit 10
+# ==========================================
+
+CASES = {
+    100: {'num_cars': 14, 'capacity': 8, 'max_trips': 2},
+    200: {'num_cars': 26, 'capacity': 8, 'max_trips': 2},
+    500: {'num_cars': 56, 'capacity': 10, 'max_trips': 2},
+}
+
+
+def run(students, graph_path, time_limit, seed, cache_dir):
+    import main
+    from telemetry import RunTelemetry
+
+    roster = instances.generate_roster(students, 'uniform', 0.3, seed=seed)
+    config = instances.case_config(dict(CASES[students], students=students), time_limit)
+    config['road_graph'] = graph_path
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        data = main.create_data_model(config, roster=roster, api_key="")
+        result = main.solve_data_model(data, config)
+    if not result:
+        return None
+    routes = result[1]
+    record = {'students': students, 'routes': len(routes)}
+
+    # 従来の地図: st_folium は再実行のたびに地図を HTML にし直す
+    t0 = time.perf_counter()
+    m = main.create_map_object(data, routes)
+    html = m.get_root().render()
+    record['legacy_seconds'] = time.perf_counter() - t0
+    record['legacy_bytes'] = len(html.encode('utf-8'))
+
+    for label in ('cold', 'warm'):
+        telemetry = RunTelemetry()
+        t0 = time.perf_counter()
+        html = main.render_map_html(data, routes, telemetry, cache_dir=cache_dir)
+        record[f'{label}_seconds'] = time.perf_counter() - t0
+        record['light_bytes'] = len(html.encode('utf-8'))
+        record[f'{label}_hits'] = telemetry.counters.get('map_cache_hits', 0)
+    return record
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, nargs='+', default=[100, 200], choices=sorted(CASES))
+    parser.add_argument('--time-limit', type=int, default=10)
+    parser.add_argument('--jitter-m', type=float, default=15.0, help='道路の形状点を横にずらす幅 (曲がった道の代わり)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    from road_graph import build_road_graph
+
+    with tempfile.TemporaryDirectory() as tmp:
+        osm_path, graph_path = os.path.join(tmp, 'city.osm'), os.path.join(tmp, 'road_graph.npz')
+        write_grid_osm(osm_path, shape_points=6, seed=args.seed, jitter_m=args.jitter_m)
+        build_road_graph(osm_path).save(graph_path)
+        cache_dir = os.path.join(tmp, 'maps')
+
+        for students in args.students:
+            record = run(students, graph_path, args.time_limit, args.seed, cache_dir)
+            if record is None:
+                print(f"{students:>4}人 解なし")
+                continue
+            print(f"{students:>4}人 ({record['routes']} 便): "
+                  f"従来 {record['legacy_bytes'] / 1024:7.0f} KB {record['legacy_seconds']:5.2f}s  "
+                  f"軽量 {record['light_bytes'] / 1024:6.0f} KB ({record['light_bytes'] / record['legacy_bytes']:5.1%}) "
+                  f"初回 {record['cold_seconds']:5.2f}s / 2回目 {record['warm_seconds'] * 1000:5.1f}ms "
+                  f"(キャッシュ {'あり' if record['warm_hits'] else 'なし'})")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import argparse
+import contextlib
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import instances
+
+# ==========================================
+# オフライン道路網 (road_graph.py) のベンチマーク
+# 合成の碁盤目の街 (.osm) から道路グラフを作り、保存・読み込み・行列・道路経路の時間を測る
+#   python benchmarks/bench_road_graph.py --size-km 14 --block-m 150 --students 100 200
+# ==========================================
+
+
+def write_grid_osm(path, size_km=14.0, block_m=150, shape_points=2, seed=0, jitter_m=0.0):
+    # 拠点を中心とした碁盤目の道路。5本ごとに幹線道路、一部の細い道は一方通行、
+    # 拠点の北を東西に流れる川は 1.5 km ごとの橋でしか渡れない。jitter_m: 形状点を道路の横方向にずらす (曲がった道)
+    import random
+    rng = random.Random(seed)
+    count = int(size_km * 1000 / block_m) + 1
+    river_row = count // 2 + int(1000 / block_m)
+    bridge_every = max(1, int(1500 / block_m))
+    half = size_km / 2
+    step_km = block_m / 1000
+
+    ids = {}
+    nodes = []
+
+    def node(x_km, y_km):
+        key = (round(x_km, 6), round(y_km, 6))
+        if key not in ids:
+            ids[key] = len(ids) + 1
+            nodes.append((ids[key], instances._offset(instances.DEPOT, x_km, y_km)))
+        return ids[key]
+
+    ways = []
+    for horizontal in (True, False):
+        for line in range(count):
+            highway = 'primary' if line % 5 == 0 else 'residential'
+            oneway = highway == 'residential' and rng.random() < 0.2
+            refs = []
+            for k in range(count - 1):
+                # 縦の道は橋の位置以外で川を渡れないので、川のところで道路を区切る
+                if not horizontal and k == river_row and line % bridge_every:
+                    if len(refs) >= 2:
+                        ways.append((refs, highway, oneway))
+                    refs = []
+                    continue
+                for s in range(shape_points + 1):
+                    t = k + s / (shape_points + 1)
+                    a, b = -half + line * step_km, -half + t * step_km
+                    if s:
+                        a += rng.uniform(-jitter_m, jitter_m) / 1000
+                    refs.append(node(b, a) if horizontal else node(a, b))
+                end = -half + (k + 1) * step_km
+                a = -half + line * step_km
+                refs.append(node(end, a) if horizontal else node(a, end))
+            refs = list(dict.fromkeys(refs))
+            if len(refs) >= 2:
+                ways.append((refs, highway, oneway))
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6'>\n")
+        for node_id, (lat, lon) in nodes:
+            f.write(f" <node id='{node_id}' lat='{lat}' lon='{lon}'/>\n")
+        for way_id, (refs, highway, oneway) in enumerate(ways, start=1):
+            f.write(f" <way id='{way_id}'>\n")
+            f.writelines(f"  <nd ref='{ref}'/>\n" for ref in refs)
+            f.write(f"  <tag k='highway' v='{highway}'/>\n")
+            if oneway:
+                f.write("  <tag k='oneway' v='yes'/>\n")
+            f.write(" </way>\n")
+        f.write("</osm>\n")
+    return len(nodes), len(ways)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-km', type=float, default=14.0)
+    parser.add_argument('--block-m', type=int, default=150)
+    parser.add_argument('--students', type=int, nargs='+', default=[100, 200])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import main
+    from road_graph import build_road_graph, RoadGraph
+
+    with tempfile.TemporaryDirectory() as tmp:
+        osm_path, npz_path = os.path.join(tmp, 'city.osm'), os.path.join(tmp, 'road_graph.npz')
+        num_nodes, num_ways = write_grid_osm(osm_path, args.size_km, args.block_m, seed=args.seed)
+        print(f"合成の .osm: ノード {num_nodes} / 道路 {num_ways} ({os.path.getsize(osm_path) / 2**20:.1f} MB)")
+
+        t0 = time.perf_counter()
+        graph = build_road_graph(osm_path)
+        t1 = time.perf_counter()
+        graph.save(npz_path)
+        t2 = time.perf_counter()
+        graph = RoadGraph.load(npz_path)
+        t3 = time.perf_counter()
+        print(f"作成 {t1 - t0:.2f}s / 保存 {t2 - t1:.2f}s ({os.path.getsize(npz_path) / 2**20:.2f} MB) / 読み込み {t3 - t2:.3f}s")
+
+        for students in args.students:
+            roster = instances.generate_roster(students, 'uniform', 0.3, seed=args.seed)
+            config = instances.case_config({'num_cars': 1, 'capacity': 1, 'max_trips': 1})
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                data = main.create_data_model(config, roster=roster, api_key="")
+            locations = data['locations']
+            t0 = time.perf_counter()
+            matrix = graph.travel_time_matrix(locations)
+            t1 = time.perf_counter()
+            haversine = np.asarray(data['time_matrix'])
+            off_diagonal = ~np.eye(len(locations), dtype=bool)
+            ratio = matrix[off_diagonal].sum() / haversine[off_diagonal].sum()
+            asymmetric = int((matrix != matrix.T).sum())
+            # 各地点から最も近い地点への区間の道路経路 (地図描画と同じ規模)
+            arcs = [(locations[i], locations[int(np.argsort(matrix[i])[1])]) for i in range(len(locations))]
+            t2 = time.perf_counter()
+            geometries = graph.route_geometries(arcs)
+            t3 = time.perf_counter()
+            points = sum(len(p) for p in geometries.values())
+            print(f"{len(locations):>4} 地点: 行列 {t1 - t0:7.3f}s (簡易計算比 {ratio:.2f} 倍, 非対称 {asymmetric} 要素)  "
+                  f"道路経路 {len(geometries)} 区間 {t3 - t2:6.3f}s ({points} 点)")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,97 @@
+import os
+import sys
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import instances
+from fake_sheets import FakeClient
+
+# ==========================================
+# スプレッドシート入出力のリクエスト数・送受信セル数 (ローカルの偽 API で計測)
+#   python benchmarks/bench_sheets.py --students 100 --runs 5
+# ==========================================
+
+SPREADSHEET_ID = "bench"
+
+
+def legacy_update(spreadsheet, df):
+    # 以前の書き込み方 (毎回認証・シートを開く・全消去して全体を書き直す)
+    spreadsheet.stats.requests['auth'] += 1
+    spreadsheet.stats.requests['open'] += 1
+    worksheet = spreadsheet.worksheet("Output")
+    worksheet.clear()
+    payload = [df.columns.values.tolist()] + df.astype(str).values.tolist()
+    worksheet.update(values=payload, range_name='A1')
+
+
+def fill_input(spreadsheet, roster):
+    worksheet = spreadsheet.add_worksheet("Input", rows=len(roster[0]) + 10, cols=10)
+    rows = [['名前', '場所名', '緯度', '経度', '希望時間', '備考']]
+    for name, location_name, loc, time_str in zip(*roster):
+        rows.append([name, location_name, str(loc[0]), str(loc[1]), time_str, 'メモ' * 10])
+    worksheet.update(values=rows, range_name='A1')
+    return worksheet
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=5, help='計算・保存を繰り返す回数 (2回目以降は1人だけ変更)')
+    args = parser.parse_args()
+
+    import main
+
+    client = FakeClient()
+    spreadsheet = client.create(SPREADSHEET_ID)
+    roster = instances.generate_roster(args.students, 'clustered', 0.3, seed=0)
+    input_sheet = fill_input(spreadsheet, roster)
+    spreadsheet.add_worksheet("Output", rows=100, cols=20)
+    legacy_spreadsheet = FakeClient().create(SPREADSHEET_ID)
+    legacy_spreadsheet.add_worksheet("Output", rows=args.students * 2 + 100, cols=20)
+    config = instances.case_config(
+        {'num_cars': max(3, args.students // 10), 'capacity': 6, 'max_trips': 2}, time_limit=1)
+
+    stats = client.stats
+    devnull = open(os.devnull, 'w')
+    read_requests = write_requests = skipped = 0
+    cells_written = legacy_cells = legacy_requests = 0
+    for run in range(args.runs):
+        if run > 0:
+            # 1人の希望時間を早める (他の車両のルートは変わらない)
+            input_sheet.cells[run * 7][4] = '18:45'
+        # 変更のない再読み込み (アプリでボタンを2回押した場合など)
+        for _ in range(2):
+            before = stats.total_requests()
+            with contextlib.redirect_stdout(devnull):
+                roster, changed = main.read_input_sheet("Input", SPREADSHEET_ID, client=client)
+            read_requests += stats.total_requests() - before
+            if not changed:
+                skipped += 1
+                continue
+            with contextlib.redirect_stdout(devnull):
+                data = main.create_data_model(config, roster=roster, api_key="")
+                _, routes = main.solve_data_model(data, config)
+                df = main.create_schedule_df(data, routes)
+
+            before, written = stats.total_requests(), stats.cells_written
+            message = main.update_google_sheets(df, SPREADSHEET_ID, client=client)
+            write_requests += stats.total_requests() - before
+            cells_written += stats.cells_written - written
+            print(f"実行 {run + 1}: {message}")
+
+            before, written = legacy_spreadsheet.stats.total_requests(), legacy_spreadsheet.stats.cells_written
+            legacy_update(legacy_spreadsheet, df)
+            legacy_requests += legacy_spreadsheet.stats.total_requests() - before
+            legacy_cells += legacy_spreadsheet.stats.cells_written - written
+
+    assert spreadsheet.worksheets["Output"]._trimmed() == legacy_spreadsheet.worksheets["Output"]._trimmed()
+    print(f"\n読み込み: {read_requests} リクエスト / {args.runs * 2} 回 (変更なしで計算を省略 {skipped} 回)")
+    print(f"書き込み: {write_requests} リクエスト / {cells_written} セル (差分)")
+    print(f"書き込み: {legacy_requests} リクエスト / {legacy_cells} セル (従来の全消去・全書き込み)")
+
+
+if __name__ == '__main__':
+    main_cli()
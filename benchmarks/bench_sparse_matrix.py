@@ -0,0 +1,117 @@
+import os
+import sys
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import instances
+
+# ==========================================
+# 近隣だけを取得する疎な行列: API の要素数とルートの質への影響
+# Google Maps の代わりに合成の道路網の移動時間 (instances.road_travel_minutes) を正解として使い、
+# 疎な行列で解いたルートを正解の移動時間で評価し直す
+#   python benchmarks/bench_sparse_matrix.py --students 100 200 --k 5 10 20 --time-limit 10
+# ==========================================
+
+# 合成の道路網は直線距離の簡易計算より遅いので、run_benchmarks のスイートより車両を多めにする
+CASES = {
+    100: {'num_cars': 14, 'capacity': 8, 'max_trips': 2},
+    200: {'num_cars': 26, 'capacity': 8, 'max_trips': 2},
+    500: {'num_cars': 56, 'capacity': 10, 'max_trips': 2},
+}
+
+
+class FakeReport:
+    def __init__(self, durations):
+        self.durations = durations
+        self.failed = {}
+        self.latencies = []
+
+    def summary(self):
+        return f"{len(self.durations)} 要素"
+
+
+class FakeFetcher:
+    # DistanceMatrixFetcher の代わりに正解の行列から返し、要求された要素数を数える
+    def __init__(self, truth):
+        self.truth = truth
+        self.elements = 0
+
+    def fetch(self, locations, cells):
+        self.elements += len(cells)
+        return FakeReport({(i, j): self.truth[i][j] for i, j in cells})
+
+
+def evaluate(data, routes, truth):
+    # 正解の移動時間で各ルートをたどり直し、走行時間の合計と到着期限の超過を求める
+    travel = late_stops = late_minutes = 0
+    for route in routes:
+        t = route['arrivals'][0]
+        for a, b in zip(route['nodes'][:-1], route['nodes'][1:]):
+            travel += truth[a][b]
+            t += truth[a][b] + (data['service_time'] if a != data['depot'] else 0)
+            if b != data['depot'] and t > data['time_windows'][b][1]:
+                late_stops += 1
+                late_minutes += t - data['time_windows'][b][1]
+    trips = max((route['vehicle_id'] // data['real_vehicle_count'] + 1 for route in routes), default=0)
+    return {'travel': travel, 'late_stops': late_stops, 'late_minutes': late_minutes, 'trips': trips}
+
+
+def run(students, layout, k, time_limit, seed):
+    import main
+
+    case = dict(CASES[students], students=students)
+    roster = instances.generate_roster(students, layout, 0.3, seed=seed)
+    config = instances.case_config(case, time_limit)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        data = main.create_data_model(config, roster=roster, api_key="")
+        truth = instances.road_travel_minutes(data['locations'], seed=seed)
+        n = len(data['locations'])
+        fetcher = FakeFetcher(truth)
+        if k:
+            data['time_matrix'], data['estimated_cells'] = main.get_sparse_distance_matrix(
+                data['locations'], "bench", k, cache=False, fetcher=fetcher)
+        else:
+            data['time_matrix'] = main.get_distance_matrix_batched(data['locations'], "bench", cache=False, fetcher=fetcher)
+        matrix = np.asarray(data['time_matrix'])
+        error = np.abs(matrix - np.asarray(truth))
+        elements = fetcher.elements
+        # 解いた後、推定値で計画した区間だけ正解の行列から取得して確かめる
+        result = main.solve_data_model(data, config, fetch_options={'api_key': "bench", 'cache': False, 'fetcher': fetcher})
+    record = {'students': students, 'layout': layout, 'k': k, 'nodes': n, 'elements': elements,
+              'verified': fetcher.elements - elements, 'share': fetcher.elements / (n * (n - 1)),
+              'mae': float(error.sum() / (n * (n - 1)))}
+    if result:
+        record.update(evaluate(data, result[1], truth))
+    return record
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, nargs='+', default=[100, 200], choices=sorted(CASES))
+    parser.add_argument('--layout', choices=['uniform', 'clustered'], default='uniform')
+    parser.add_argument('--k', type=int, nargs='+', default=[5, 10, 20], help='近隣の数 (0 は全要素を取得)')
+    parser.add_argument('--time-limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for students in args.students:
+        base = None
+        for k in [0] + [k for k in args.k if k]:
+            record = run(students, args.layout, k, args.time_limit, args.seed)
+            label = f"k={k}" if k else "全要素"
+            if 'travel' not in record:
+                print(f"{students:>4}人 {label:<6} 要素 {record['elements']:>7}  解なし")
+                continue
+            base = base or record
+            print(f"{students:>4}人 {label:<6} 要素 {record['elements']:>7} + 確認 {record['verified']:>4} ({record['share']:6.1%})  "
+                  f"行列の平均誤差 {record['mae']:5.2f} 分  走行 {record['travel']:>5} 分 "
+                  f"({record['travel'] / base['travel'] - 1:+6.1%})  便 {record['trips']}  "
+                  f"期限超過 {record['late_stops']} 地点 / {record['late_minutes']} 分")
+
+
+if __name__ == '__main__':
+    main_cli()
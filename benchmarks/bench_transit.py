@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
+import main
+import instances
+
+# ==========================================
+# 遷移コールバック vs 事前計算行列 のベンチマーク
+#   python benchmarks/bench_transit.py --stops 80 --time-limit 60
+# ==========================================
+
+def make_data(num_stops, num_cars, capacity, seed):
+    roster = instances.generate_roster(num_stops, 'uniform', tightness=0.0, seed=seed, sibling_rate=0.0)
+    config = {'num_cars': num_cars, 'capacity': capacity, 'max_trips': 2,
+              'start_minutes': 18 * 60, 'end_minutes': 21 * 60, 'service_time': 5}
+    return main.create_data_model(config, roster=roster, api_key="")
+
+def run(data, transit, time_limit):
+    t0 = time.perf_counter()
+    manager, routing = main.build_routing_model(data, transit=transit)
+    build_seconds = time.perf_counter() - t0
+
+    solutions = []
+    routing.AddAtSolutionCallback(lambda: solutions.append(routing.CostVar().Max()))
+
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    params.time_limit.seconds = time_limit
+
+    t0 = time.perf_counter()
+    solution = routing.SolveWithParameters(params)
+    solve_seconds = time.perf_counter() - t0
+    solver = routing.solver()
+    return {
+        'transit': transit,
+        'build_s': build_seconds,
+        'solve_s': solve_seconds,
+        'objective': solution.ObjectiveValue() if solution else None,
+        'solutions': len(solutions),
+        'branches': solver.Branches(),
+        'failures': solver.Failures(),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stops', type=int, default=60)
+    parser.add_argument('--cars', type=int, default=10)
+    parser.add_argument('--capacity', type=int, default=8)
+    parser.add_argument('--time-limit', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    data = make_data(args.stops, args.cars, args.capacity, args.seed)
+    results = [run(data, transit, args.time_limit) for transit in ('callback', 'matrix')]
+
+    print(f"\n{args.stops} 地点 / 車両 {data['num_vehicles']} / 制限 {args.time_limit} 秒 (GUIDED_LOCAL_SEARCH)")
+    print(f"{'方式':<10}{'構築(s)':>10}{'探索(s)':>10}{'目的値':>10}{'解更新':>10}{'分岐数':>14}{'失敗数':>14}")
+    for r in results:
+        print(f"{r['transit']:<10}{r['build_s']:>10.3f}{r['solve_s']:>10.1f}{str(r['objective']):>10}"
+              f"{r['solutions']:>10}{r['branches']:>14}{r['failures']:>14}")
+    base, fast = results
+    if base['branches']:
+        print(f"\n同じ制限時間内の探索量 (分岐数): {fast['branches'] / base['branches']:.1f} 倍")
+
+if __name__ == '__main__':
+    main_cli()
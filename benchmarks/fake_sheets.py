@@ -0,0 +1,143 @@
+import re
+from collections import Counter
+
+# ==========================================
+# Google スプレッドシート API のローカルな偽物 (gspread の使う部分だけ)
+# API リクエスト数と送受信したセル数を数える
+# ==========================================
+
+
+def _column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - ord('A') + 1
+    return index - 1
+
+
+def _split_range(range_name):
+    # "'Input'!B:B" -> ("Input", "B:B")
+    if '!' in range_name:
+        sheet, cells = range_name.rsplit('!', 1)
+        return sheet.strip("'"), cells
+    return None, range_name
+
+
+class FakeStats:
+    def __init__(self):
+        self.requests = Counter()
+        self.cells_read = 0
+        self.cells_written = 0
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows=100, cols=20, stats=None):
+        self.title = title
+        self.row_count = rows
+        self.col_count = cols
+        self.cells = []  # 値の入っている部分だけを保持する (行のリスト)
+        self.stats = stats or FakeStats()
+
+    def _set(self, row, col, value):
+        if row >= self.row_count or col >= self.col_count:
+            raise ValueError(f"範囲外への書き込み: 行 {row + 1} / 列 {col + 1}")
+        while len(self.cells) <= row:
+            self.cells.append([])
+        line = self.cells[row]
+        while len(line) <= col:
+            line.append('')
+        line[col] = str(value)
+        self.stats.cells_written += 1
+
+    def _trimmed(self):
+        rows = [list(row) for row in self.cells]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        width = max((len(row) for row in rows), default=0)
+        return [row + [''] * (width - len(row)) for row in rows]
+
+    def _write_block(self, cells, values):
+        match = re.match(r"([A-Z]+)(\d+)", cells)
+        col0, row0 = _column_index(match.group(1)), int(match.group(2)) - 1
+        for r, row in enumerate(values):
+            for c, value in enumerate(row):
+                self._set(row0 + r, col0 + c, value)
+
+    def get_all_values(self):
+        self.stats.requests['values.get'] += 1
+        values = self._trimmed()
+        self.stats.cells_read += sum(len(row) for row in values)
+        return values
+
+    def batch_update(self, data, **kwargs):
+        self.stats.requests['values.batchUpdate'] += 1
+        for item in data:
+            self._write_block(_split_range(item['range'])[1], item['values'])
+
+    def update(self, values=None, range_name='A1', **kwargs):
+        self.stats.requests['values.update'] += 1
+        self._write_block(range_name, values)
+
+    def clear(self):
+        self.stats.requests['values.clear'] += 1
+        self.cells = []
+
+    def resize(self, rows=None, cols=None):
+        self.stats.requests['batchUpdate'] += 1
+        self.row_count = rows or self.row_count
+        self.col_count = cols or self.col_count
+
+
+class FakeSpreadsheet:
+    def __init__(self, spreadsheet_id, stats=None):
+        self.id = spreadsheet_id
+        self.stats = stats or FakeStats()
+        self.worksheets = {}
+
+    def worksheet(self, title):
+        self.stats.requests['metadata'] += 1
+        if title not in self.worksheets:
+            raise LookupError(f"シート '{title}' がありません")
+        return self.worksheets[title]
+
+    def add_worksheet(self, title, rows=100, cols=20):
+        self.stats.requests['batchUpdate'] += 1
+        worksheet = self.worksheets[title] = FakeWorksheet(title, rows, cols, self.stats)
+        return worksheet
+
+    def values_batch_get(self, ranges, params=None):
+        self.stats.requests['values.batchGet'] += 1
+        by_columns = (params or {}).get('majorDimension') == 'COLUMNS'
+        value_ranges = []
+        for range_name in ranges:
+            title, cells = _split_range(range_name)
+            rows = self.worksheets[title]._trimmed()
+            start, end = cells.split(':')
+            if start.isdigit():
+                selected = rows[int(start) - 1:int(end)]
+            else:
+                c0, c1 = _column_index(start), _column_index(end)
+                selected = [row[c0:c1 + 1] for row in rows]
+                if by_columns:
+                    selected = [list(column) for column in zip(*selected)] if selected else []
+            # 実際の API と同じく、末尾の空セルは返さない
+            selected = [row[:max([i + 1 for i, v in enumerate(row) if v != ''] + [0])] for row in selected]
+            self.stats.cells_read += sum(len(row) for row in selected)
+            value_ranges.append({'range': range_name, 'values': selected} if any(selected) else {'range': range_name})
+        return {'valueRanges': value_ranges}
+
+
+class FakeClient:
+    def __init__(self):
+        self.stats = FakeStats()
+        self.spreadsheets = {}
+
+    def create(self, spreadsheet_id):
+        spreadsheet = self.spreadsheets[spreadsheet_id] = FakeSpreadsheet(spreadsheet_id, self.stats)
+        return spreadsheet
+
+    def open_by_key(self, spreadsheet_id):
+        self.stats.requests['open'] += 1
+        return self.spreadsheets[spreadsheet_id]
@@ -0,0 +1,109 @@
+import math
+import random
+
+# ==========================================
+# ベンチマーク用の合成インスタンス生成
+# ==========================================
+
+DEPOT = (35.68, 139.76)
+KM_PER_DEG_LAT = 111.0
+
+# 規模・配置・締切の厳しさ・車両条件を変えた標準スイート
+DEFAULT_SUITE = [
+    {'name': 'uniform-20', 'students': 20, 'layout': 'uniform', 'tightness': 0.2, 'num_cars': 3, 'capacity': 5, 'max_trips': 2},
+    {'name': 'clustered-20', 'students': 20, 'layout': 'clustered', 'tightness': 0.5, 'num_cars': 3, 'capacity': 5, 'max_trips': 2},
+    {'name': 'uniform-50', 'students': 50, 'layout': 'uniform', 'tightness': 0.3, 'num_cars': 8, 'capacity': 6, 'max_trips': 2},
+    {'name': 'clustered-50', 'students': 50, 'layout': 'clustered', 'tightness': 0.3, 'num_cars': 6, 'capacity': 6, 'max_trips': 2},
+    {'name': 'uniform-100', 'students': 100, 'layout': 'uniform', 'tightness': 0.3, 'num_cars': 10, 'capacity': 8, 'max_trips': 2},
+    {'name': 'clustered-100-tight', 'students': 100, 'layout': 'clustered', 'tightness': 0.7, 'num_cars': 10, 'capacity': 8, 'max_trips': 2},
+    {'name': 'uniform-200', 'students': 200, 'layout': 'uniform', 'tightness': 0.3, 'num_cars': 20, 'capacity': 8, 'max_trips': 2},
+    {'name': 'clustered-500', 'students': 500, 'layout': 'clustered', 'tightness': 0.3, 'num_cars': 40, 'capacity': 10, 'max_trips': 2},
+]
+QUICK_SUITE = [case for case in DEFAULT_SUITE if case['students'] <= 50]
+
+
+def _offset(center, dx_km, dy_km):
+    lat = center[0] + dy_km / KM_PER_DEG_LAT
+    lon = center[1] + dx_km / (KM_PER_DEG_LAT * math.cos(math.radians(center[0])))
+    return (round(lat, 6), round(lon, 6))
+
+
+def _format_minutes(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def generate_roster(num_students, layout='uniform', tightness=0.3, seed=0, radius_km=6.0,
+                    num_clusters=5, sibling_rate=0.1, start_minutes=18 * 60, end_minutes=20 * 60):
+    # create_data_model に渡せる (名前, 場所名, 座標, 希望時間) を返す。0行目は拠点
+    # tightness: 希望時間 (到着期限) を持つ児童の割合。期限は開始〜終了の後半に分布する
+    rng = random.Random(seed)
+    centers = [
+        _offset(DEPOT, rng.uniform(-radius_km, radius_km) * 0.7, rng.uniform(-radius_km, radius_km) * 0.7)
+        for _ in range(num_clusters)
+    ]
+
+    names, location_names, locations, time_strs = ['施設'], ['拠点'], [DEPOT], ['']
+    for i in range(1, num_students + 1):
+        if i > 1 and rng.random() < sibling_rate:
+            # 兄弟: 直前の児童と同じ住所
+            location_names.append(location_names[-1])
+            locations.append(locations[-1])
+        else:
+            if layout == 'clustered':
+                center = rng.choice(centers)
+                loc = _offset(center, rng.gauss(0, radius_km / 8), rng.gauss(0, radius_km / 8))
+            else:
+                loc = _offset(DEPOT, rng.uniform(-radius_km, radius_km), rng.uniform(-radius_km, radius_km))
+            location_names.append(f"家{i}")
+            locations.append(loc)
+        names.append(f"児童{i}")
+
+        if rng.random() < tightness:
+            span = end_minutes - start_minutes
+            deadline = start_minutes + int(span * rng.uniform(0.5, 1.0))
+            time_strs.append(_format_minutes(deadline))
+        else:
+            time_strs.append('')
+    return names, location_names, locations, time_strs
+
+
+def case_config(case, time_limit=60, start_minutes=18 * 60, end_minutes=20 * 60):
+    return {
+        'num_cars': case['num_cars'],
+        'capacity': case['capacity'],
+        'max_trips': case['max_trips'],
+        'start_minutes': start_minutes,
+        'end_minutes': end_minutes,
+        'service_time': case.get('service_time', 3),
+        'time_limit': time_limit,
+    }
+
+
+def road_travel_minutes(locations, seed=0, river_offset_km=1.0, bridge_penalty=6.0):
+    # 直線距離では表せない「道路網らしい」移動時間行列 (Google Maps の代わりの正解データ)
+    #   斜めの碁盤目の道路 (回転したマンハッタン距離)、近距離ほど遅い速度、地点ごとの出入りの時間、
+    #   拠点の北を東西に流れる川 (渡る時だけ橋まで迂回する) を含む
+    rng = random.Random(seed)
+    angle = rng.uniform(0, math.pi / 2)
+    points = []
+    for lat, lon in locations:
+        y = (lat - DEPOT[0]) * KM_PER_DEG_LAT
+        x = (lon - DEPOT[1]) * KM_PER_DEG_LAT * math.cos(math.radians(DEPOT[0]))
+        points.append((x * math.cos(angle) + y * math.sin(angle), -x * math.sin(angle) + y * math.cos(angle), y))
+    access = [rng.uniform(0.5, 2.5) for _ in locations]
+
+    matrix = []
+    for i, (xi, yi, ni) in enumerate(points):
+        row = []
+        for j, (xj, yj, nj) in enumerate(points):
+            if i == j:
+                row.append(0)
+                continue
+            road_km = abs(xi - xj) + abs(yi - yj)
+            speed = 24.0 if road_km < 3 else 36.0
+            minutes = access[i] + access[j] + road_km / speed * 60
+            if (ni < river_offset_km) != (nj < river_offset_km):
+                minutes += bridge_penalty
+            row.append(int(round(minutes)))
+        matrix.append(row)
+    return matrix
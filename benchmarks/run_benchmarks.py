@@ -0,0 +1,137 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+import contextlib
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import instances
+
+# ==========================================
+# solve_vrp パイプラインのベンチマーク (オフライン・簡易計算行列)
+#   python benchmarks/run_benchmarks.py --suite quick --time-limit 10 --out bench_results
+#   python benchmarks/run_benchmarks.py --baseline bench_results.json   # 回帰チェック
+#   python benchmarks/run_benchmarks.py --cases uniform-200 clustered-500 --decompose   # 分割計算
+# ==========================================
+
+FIELDS = ['name', 'students', 'nodes', 'layout', 'tightness', 'num_cars', 'capacity', 'vehicles',
+          'data_s', 'build_s', 'solve_s', 'output_s', 'solved', 'objective', 'vehicles_used',
+          'trips_used', 'clusters', 'py_peak_mb', 'peak_rss_mb']
+
+
+def run_case(case, time_limit, seed, decompose=False):
+    # 1ケースずつ新しいプロセスで実行し、ピークメモリを他のケースと混ぜない
+    import main
+
+    tracemalloc.start()
+    roster = instances.generate_roster(case['students'], case['layout'], case['tightness'], seed=seed)
+    config = dict(instances.case_config(case, time_limit), decompose=decompose)
+    record = {key: case.get(key) for key in ('name', 'students', 'layout', 'tightness', 'num_cars', 'capacity')}
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        t0 = time.perf_counter()
+        data = main.create_data_model(config, roster=roster, api_key="")
+        t1 = time.perf_counter()
+        # 便数の自動調整 (find_first_solution) と探索を含む
+        result = main.solve_data_model(data, config)
+        t2 = time.perf_counter()
+        objective, routes = result if result else (None, [])
+        main.create_schedule_df(data, routes)
+        t3 = time.perf_counter()
+        # 確定した便数でのモデル構築時間
+        main.build_routing_model(data)
+        t4 = time.perf_counter()
+
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    record.update({
+        'nodes': len(data['locations']),
+        'vehicles': data['num_vehicles'],
+        'data_s': round(t1 - t0, 3),
+        'build_s': round(t4 - t3, 3),
+        'solve_s': round(t2 - t1, 3),
+        'output_s': round(t3 - t2, 3),
+        'solved': result is not None,
+        'objective': objective,
+        'vehicles_used': len(routes),
+        'trips_used': max((route['vehicle_id'] // data['real_vehicle_count'] + 1 for route in routes), default=0),
+        'clusters': len(data['decomposition']['clusters']) if data.get('decomposition') else 1,
+        'py_peak_mb': round(py_peak / 2**20, 1),
+        # Linux の ru_maxrss は KB 単位
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+    return record
+
+
+def compare(results, baseline, time_ratio=1.5, time_slack=0.5, objective_ratio=1.05):
+    # 基準より大きく遅い・悪化した・解けなくなったケースを列挙する
+    base_by_name = {record['name']: record for record in baseline}
+    regressions = []
+    for record in results:
+        base = base_by_name.get(record['name'])
+        if base is None:
+            continue
+        if base['solved'] and not record['solved']:
+            regressions.append(f"{record['name']}: 解けなくなりました")
+            continue
+        for key in ('data_s', 'build_s'):
+            if record[key] > base[key] * time_ratio + time_slack:
+                regressions.append(f"{record['name']}: {key} {base[key]} -> {record[key]}")
+        if base['objective'] and record['objective'] and record['objective'] > base['objective'] * objective_ratio:
+            regressions.append(f"{record['name']}: objective {base['objective']} -> {record['objective']}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--suite', choices=['default', 'quick'], default='default')
+    parser.add_argument('--cases', nargs='*', help='実行するケース名 (省略時はスイート全体)')
+    parser.add_argument('--time-limit', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='bench_results', help='出力先 (拡張子なし。.json と .csv を書き出す)')
+    parser.add_argument('--baseline', help='比較する過去の結果 JSON')
+    parser.add_argument('--decompose', action='store_true', help='地域ごとに分割して解く (decomposition.py)')
+    args = parser.parse_args()
+
+    suite = instances.QUICK_SUITE if args.suite == 'quick' else instances.DEFAULT_SUITE
+    if args.cases:
+        suite = [case for case in suite if case['name'] in args.cases]
+
+    results = []
+    for case in suite:
+        with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+            record = pool.submit(run_case, case, args.time_limit, args.seed, args.decompose).result()
+        results.append(record)
+        print(f"{record['name']:<22} 地点 {record['nodes']:>4}  データ {record['data_s']:>7.3f}s  構築 {record['build_s']:>7.3f}s  "
+              f"探索 {record['solve_s']:>7.2f}s  目的値 {str(record['objective']):>7}  便 {record['trips_used']}  "
+              f"クラスタ {record['clusters']}  "
+              f"RSS {record['peak_rss_mb']:>7.1f}MB")
+
+    with open(args.out + '.json', 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    with open(args.out + '.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"結果を {args.out}.json / {args.out}.csv に保存しました")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print("⚠️ 性能の回帰:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("回帰はありません")
+
+
+if __name__ == '__main__':
+    main_cli()
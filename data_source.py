@@ -0,0 +1,324 @@
+import os
+import math
+import tomllib
+import contextlib
+from datetime import datetime, timedelta
+import sheets
+from telemetry import RunTelemetry
+from matrix import get_distance_matrix_batched, get_sparse_distance_matrix, calculate_haversine_matrix
+
+# gspread / google.oauth2 / pandas / streamlit は使う関数の中でだけ読み込む (起動を軽くするため)
+
+# ==========================================
+# 1. 時刻の変換
+# ==========================================
+
+def time_str_to_minutes(t_str, default_minutes):
+    if not t_str or str(t_str).strip() == "":
+        return default_minutes
+    try:
+        t = datetime.strptime(str(t_str).strip(), '%H:%M')
+        return t.hour * 60 + t.minute
+    except:
+        return default_minutes
+
+def format_minutes_to_time(minutes):
+    base_time = datetime(2024, 1, 1, 0, 0, 0)
+    target_time = base_time + timedelta(minutes=int(minutes))
+    return target_time.strftime("%H:%M")
+
+# ==========================================
+# 2. 名簿の入出力 (スプレッドシート / ファイル)
+# ==========================================
+
+SPREADSHEET_ID = "10DPMrEQZkOdYJFVIcjqVas7HCuu7xCBwyGD4ha7BqG0" # ★要書き換え★
+
+def parse_roster_records(records):
+    # 1行 = 1人 (先頭行は拠点) の辞書のリストを (名前, 場所名, 座標, 希望時間) に変換する
+    names, location_names, locations, time_windows = [], [], [], []
+    for row in records:
+        names.append(str(row['名前']))
+        location_names.append(str(row['場所名']))
+        locations.append((float(row['緯度']), float(row['経度'])))
+        time_str = row.get('希望時間', '')
+        time_windows.append('' if time_str is None or time_str != time_str else str(time_str).strip())
+    return names, location_names, locations, time_windows
+
+INPUT_COLUMNS = ['名前', '場所名', '緯度', '経度', '希望時間']
+
+def read_input_sheet(sheet_name="Input", spreadsheet_id=SPREADSHEET_ID, client=None):
+    # 戻り値: (名簿, 前回の読み込みから内容が変わったか)
+    # 認証済みクライアントは使い回し、必要な列だけを1回のリクエストで読む
+    print(f"シート '{sheet_name}' からデータを読み込んでいます...")
+    try:
+        spreadsheet = sheets.open_spreadsheet(spreadsheet_id, client)
+        records = sheets.read_columns(spreadsheet, spreadsheet_id, sheet_name, INPUT_COLUMNS, required=INPUT_COLUMNS[:4])
+    except Exception as e:
+        print(f"スプレッドシート読み込みエラー: {e}")
+        sheets.reset()
+        return ([], [], [], []), True
+
+    changed = sheets.fingerprint_changed(spreadsheet_id, sheet_name, records)
+    names, location_names, locations, time_windows = parse_roster_records(records)
+    print(f"{len(names)} 件のデータを読み込みました。{'' if changed else ' (前回から変更なし)'}")
+    return (names, location_names, locations, time_windows), changed
+
+def get_input_from_sheet(sheet_name="Input", spreadsheet_id=SPREADSHEET_ID, client=None):
+    roster, _ = read_input_sheet(sheet_name, spreadsheet_id, client)
+    return roster
+
+def read_roster_file(path):
+    # Input シートと同じ列 (名前, 場所名, 緯度, 経度, 希望時間) の CSV / Parquet を読み込む
+    import pandas as pd
+    print(f"ファイル '{path}' からデータを読み込んでいます...")
+    if str(path).lower().endswith(('.parquet', '.pq')):
+        try:
+            df = pd.read_parquet(path)
+        except ImportError as e:
+            raise ImportError(f"Parquet の読み込みには pyarrow が必要です (pip install pyarrow): {e}") from e
+    else:
+        df = pd.read_csv(path, dtype={'希望時間': str}, keep_default_na=False)
+    names, location_names, locations, time_windows = parse_roster_records(df.to_dict('records'))
+    print(f"{len(names)} 件のデータを読み込みました。")
+    return names, location_names, locations, time_windows
+
+def update_google_sheets(df, spreadsheet_id=SPREADSHEET_ID, sheet_name="Output", client=None):
+    # 今のシートの値と比べ、変わった行だけを1回の batchUpdate で書き込む
+    try:
+        payload = [] if df.empty else [df.columns.values.tolist()] + df.astype(str).values.tolist()
+        spreadsheet = sheets.open_spreadsheet(spreadsheet_id, client)
+        worksheet = sheets.open_worksheet(spreadsheet, sheet_name, create=True, rows=max(100, len(payload)))
+        current = worksheet.get_all_values()
+
+        updates = sheets.diff_rows(current, payload)
+        if updates:
+            width = max(len(row) for update in updates for row in update['values'])
+            if len(payload) > worksheet.row_count or width > worksheet.col_count:
+                worksheet.resize(rows=max(len(payload), worksheet.row_count), cols=max(width, worksheet.col_count))
+            worksheet.batch_update(updates)
+        if not payload:
+            return "データがありませんでした"
+        changed_rows = sum(len(update['values']) for update in updates)
+        return f"成功しました！ ({changed_rows} 行を更新)"
+    except Exception as e:
+        sheets.reset()
+        return f"エラー: {e}"
+
+# ==========================================
+# 3. データモデル構築
+# ==========================================
+
+def load_google_maps_api_key():
+    # 環境変数 -> Streamlit の secrets -> .streamlit/secrets.toml の順に探す
+    if os.environ.get("GOOGLE_MAPS_API_KEY"):
+        return os.environ["GOOGLE_MAPS_API_KEY"]
+    try:
+        # Streamlit 無しでも動かせるよう、必要な時だけ読み込む
+        import streamlit as st
+        return st.secrets["GOOGLE_MAPS_API_KEY"]
+    except Exception:
+        try:
+            with open(".streamlit/secrets.toml", "rb") as f:
+                secrets = tomllib.load(f)
+                return secrets["GOOGLE_MAPS_API_KEY"]
+        except:
+            return ""
+
+def create_data_model(config, roster=None, source=None, api_key=None, telemetry=None):
+    # roster: 読み込み済みの (名前, 場所名, 座標, 希望時間) があればシートを読み直さない
+    # source: roster を返す関数 (省略時は Google スプレッドシートの Input シート)
+    # api_key: "" を渡すと Google Maps API を使わず簡易計算 (オフライン) で行列を作る
+    # telemetry: RunTelemetry を渡すと各フェーズの時間を記録する
+    telemetry = telemetry or RunTelemetry()
+    data = {}
+    if api_key is None:
+        api_key = load_google_maps_api_key()
+
+    if roster is None:
+        with telemetry.phase('roster_read'):
+            roster = source() if source is not None else get_input_from_sheet("Input")
+    names, loc_names, locations, time_strs = roster
+    if not names: return None
+
+    data['names'] = names
+    data['location_names'] = loc_names
+
+    # 同じ座標の児童 (兄弟・グループホーム等) は1つの訪問ノードにまとめる
+    # node_members[ノード番号] = そのノードに含まれる児童の行番号 (0番は拠点)
+    node_members = [[0]]
+    node_locations = [locations[0]]
+    node_of_location = {}
+    for i in range(1, len(locations)):
+        loc = locations[i]
+        # 1台の定員を超える人数は同じ地点の別ノードに分ける
+        if loc in node_of_location and len(node_members[node_of_location[loc]]) < config['capacity']:
+            node_members[node_of_location[loc]].append(i)
+        else:
+            node_of_location[loc] = len(node_members)
+            node_members.append([i])
+            node_locations.append(loc)
+    if len(node_members) < len(locations):
+        print(f"同一地点の児童をまとめました: {len(locations) - 1} 人 -> {len(node_members) - 1} 地点")
+
+    data['node_members'] = node_members
+    data['locations'] = locations = node_locations
+    num_locations = len(locations)
+    telemetry.count('students', len(names) - 1)
+    telemetry.count('nodes', num_locations)
+
+    # 車両設定 (1台 × 1便 = 1仮想車両)
+    # 便数は定員上の最小値から始め、解が見つからない時だけ max_trips まで増やす (find_first_solution)
+    real_vehicle_count = config['num_cars']
+    capacity = config['capacity']
+    fleet_capacity = real_vehicle_count * capacity
+    
+    num_students = len(names) - 1
+    if fleet_capacity > 0:
+        min_trips_needed = max(1, math.ceil(num_students / fleet_capacity))
+    else:
+        min_trips_needed = 1
+    max_trips = config.get('max_trips') or min_trips_needed + 2
+
+    data['real_vehicle_count'] = real_vehicle_count
+    data['capacity'] = capacity
+    data['min_trips'] = min_trips_needed
+    data['max_trips'] = max_trips
+    set_vehicle_pool(data, min(min_trips_needed, max_trips))
+    data['depot'] = 0
+    data['service_time'] = config['service_time']
+    data['demands'] = [0] + [len(members) for members in node_members[1:]]
+    
+    # 時間窓 (到着期限対応)
+    global_start = config['start_minutes']
+    global_end = config['end_minutes']
+    specific_time_windows = []
+    
+    print("\n--- 時間指定 ---")
+    for i, t_str in enumerate(time_strs):
+        if i == 0:
+            specific_time_windows.append([global_start, 1440])
+            continue
+        
+        if t_str and str(t_str).strip() != "":
+            deadline = time_str_to_minutes(t_str, global_end)
+            start = global_start
+            if deadline < start:
+                print(f"⚠️ 締切補正: {names[i]} ({t_str})")
+                deadline = start + 30 
+            specific_time_windows.append([start, deadline])
+        else:
+            specific_time_windows.append([global_start, global_end])
+    print("----------------\n")
+    
+    # ノードの時間窓は所属する児童の中で最も厳しいもの
+    data['time_windows'] = [
+        [max(specific_time_windows[i][0] for i in members), min(specific_time_windows[i][1] for i in members)]
+        for members in node_members
+    ]
+
+    # 大規模名簿は地域ごとに分割して解く (decomposition.py)。行列も分割計算で使う要素だけを取得する
+    cells = None
+    if config.get('decompose'):
+        import decomposition
+        with telemetry.phase('clustering'):
+            data['decomposition'] = decomposition.plan_clusters(data, config)
+        if data['decomposition'] and api_key and not config.get('road_graph'):
+            cells = decomposition.required_cells(data['decomposition'], data['depot'])
+
+    with telemetry.phase('matrix'):
+        data['time_matrix'] = None
+        if config.get('road_graph'):
+            # 道路グラフ (road_graph.py) があれば、通信せずに道路網上の移動時間を使う
+            from road_graph import load_road_graph
+            try:
+                data['time_matrix'] = load_road_graph(config['road_graph']).travel_time_matrix(locations).tolist()
+                data['road_graph'] = config['road_graph']
+                print(f"道路グラフで移動時間を計算しました ({len(locations)} 地点)")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ 道路グラフを読み込めません ({e})。通常の方法で移動時間を求めます")
+        if not data['time_matrix']:
+            data['time_matrix'], data['estimated_cells'] = build_time_matrix(locations, config, api_key, cells, telemetry)
+            # 分割計算で使わない要素は推定値のまま。分割せずに解き直す時は complete_time_matrix で取得する
+            data['partial_matrix'] = cells is not None
+    return data
+
+def build_time_matrix(locations, config, api_key, cells=None, telemetry=None):
+    # Google Maps API の移動時間行列 (api_key が空なら簡易計算)
+    # cells: 取得する要素 (省略時は全要素)。それ以外は簡易計算の値で埋める
+    # 戻り値: (行列, 疎な行列で推定値のまま使う要素の bool 配列 / 疎な行列でなければ None)
+    def estimate():
+        return calculate_haversine_matrix(
+            locations, config.get('speed_kmh', 20.0), config.get('speed_model'), config.get('detour_factor', 1.0))
+
+    if api_key and config.get('sparse_neighbors'):
+        # 近隣だけを取得し、残りは取得結果から較正した推定で埋める。
+        # 推定値の区間は、解いた後に実際に使う区間だけ取得して確かめる (verify_estimated_arcs)
+        return get_sparse_distance_matrix(
+            locations, api_key, config['sparse_neighbors'], cells=cells, telemetry=telemetry,
+            speed_kmh=config.get('speed_kmh', 20.0))
+    matrix = None
+    if api_key:
+        matrix = get_distance_matrix_batched(
+            locations, api_key, telemetry=telemetry, cells=cells, fallback=estimate() if cells is not None else None)
+    return matrix or estimate(), None
+
+def complete_time_matrix(data, config, api_key=None, telemetry=None):
+    # 分割計算用に一部の要素だけ取得した行列を、全要素の行列に置き換える (分割せずに解き直す前に使う)
+    # 取得済みの要素は経路キャッシュから読むので、API で取得するのは残りの要素だけ
+    telemetry = telemetry or RunTelemetry()
+    if api_key is None:
+        api_key = load_google_maps_api_key()
+    with telemetry.phase('matrix'):
+        data['time_matrix'], data['estimated_cells'] = build_time_matrix(
+            data['locations'], config, api_key, telemetry=telemetry)
+    data['partial_matrix'] = False
+    return data
+
+def verify_estimated_arcs(data, arcs, api_key=None, telemetry=None, **fetch_options):
+    # arcs のうち疎な行列で推定値のままの区間だけ実際の移動時間を取得し、行列を置き換える
+    # fetch_options: get_distance_matrix_batched に渡す cache / fetcher (ベンチマーク用)
+    # 戻り値: 値を置き換えた区間 {(出発, 到着)}
+    estimated = data.get('estimated_cells')
+    if estimated is None:
+        return set()
+    arcs = {(a, b) for a, b in arcs if a != b and estimated[a][b]}
+    if not arcs:
+        return set()
+    if api_key is None:
+        api_key = load_google_maps_api_key()
+    print(f"推定値の {len(arcs)} 区間の実際の移動時間を取得します")
+    from matrix_fetcher import FAILED_MINUTES
+    with telemetry.phase('matrix') if telemetry else contextlib.nullcontext():
+        matrix = get_distance_matrix_batched(
+            data['locations'], api_key, telemetry=telemetry, cells=arcs, fallback=data['time_matrix'], **fetch_options)
+    replaced = set()
+    ratios = data.setdefault('estimate_ratios', [])
+    for a, b in arcs:
+        if matrix[a][b] != FAILED_MINUTES:
+            ratios.append(matrix[a][b] / max(1, data['time_matrix'][a][b]))
+            data['time_matrix'][a][b] = matrix[a][b]
+            estimated[a][b] = False
+            replaced.add((a, b))
+    if telemetry:
+        telemetry.count('verified_arcs', len(replaced))
+    return replaced
+
+def pad_estimated_cells(data):
+    # 推定値のままの区間を、確かめた区間で最も過小だった比率まで水増しする (解き直しで別の過小な区間を選ばないように)
+    # 戻り値: 水増しした比率 (1.0 なら何もしていない)
+    ratio = max(data.get('estimate_ratios') or [1.0])
+    estimated = data.get('estimated_cells')
+    if estimated is None or ratio <= 1:
+        return 1.0
+    for a, row in enumerate(estimated):
+        for b, is_estimate in enumerate(row):
+            if is_estimate and a != b:
+                data['time_matrix'][a][b] = math.ceil(data['time_matrix'][a][b] * ratio)
+    # 以後の比率は水増し後の値に対して測る
+    data['estimate_ratios'] = []
+    return ratio
+
+def set_vehicle_pool(data, trips):
+    data['trips'] = trips
+    data['num_vehicles'] = data['real_vehicle_count'] * trips
+    data['vehicle_capacities'] = [data['capacity']] * data['num_vehicles']
@@ -0,0 +1,339 @@
+import io
+import math
+import time
+import contextlib
+import multiprocessing
+import numpy as np
+from data_source import set_vehicle_pool
+from solver import (
+    build_routing_model, make_search_parameters, extract_routes, solve_data_model,
+    is_cancelled, add_cancel_limit, worker_cancel_event, cancellable_process_pool,
+)
+from telemetry import RunTelemetry
+
+# ==========================================
+# 大規模名簿向け: 地域で分割してから解く (cluster-first, route-second)
+#   1. 地点を場所と到着期限で、定員に見合った大きさのクラスタに分ける
+#   2. クラスタごとに車両を割り当て、独立した小さな問題として並列に解く
+#   3. 近いクラスタ同士を2つずつ合わせ、現在の解から局所探索で改善する
+# ==========================================
+
+CLUSTER_SIZE = 50  # 1クラスタあたりの目安の地点数
+DEADLINE_WEIGHT_KM = 0.2  # 到着期限1分の差を何 km の距離とみなすか
+BALANCE_SLACK = 0.1  # クラスタの人数の偏りをどこまで許すか
+CLUSTER_PROBE_TIME_LIMIT = 1  # クラスタごとの初期解探索の時間制限 (秒)
+IMPROVEMENT_ROUNDS = 3  # 隣のクラスタと組にして改善する回数 (毎回別の組み合わせ)
+
+
+def _node_features(data, deadline_weight):
+    # 拠点からの東西・南北の距離 (km) と到着期限を特徴量にする
+    coords = np.asarray(data['locations'], dtype=np.float64)
+    lat0, lon0 = coords[data['depot']]
+    x = (coords[:, 1] - lon0) * 111.0 * math.cos(math.radians(lat0))
+    y = (coords[:, 0] - lat0) * 111.0
+    start = data['time_windows'][data['depot']][0]
+    deadline = np.array([window[1] - start for window in data['time_windows']], dtype=np.float64)
+    return np.column_stack([x, y, deadline * deadline_weight])
+
+
+def _balanced_kmeans(points, weights, k, slack=BALANCE_SLACK, iterations=15, seed=0):
+    # 人数 (weights) の上限つき k-means。迷いの大きい (2番目に近い中心との差が大きい) 地点から割り当てる
+    rng = np.random.default_rng(seed)
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        dist = np.min([((points - c) ** 2).sum(axis=1) for c in centers], axis=0)
+        centers.append(points[rng.choice(len(points), p=dist / dist.sum())] if dist.sum() > 0 else points[rng.integers(len(points))])
+    centers = np.array(centers)
+    limit = math.ceil(weights.sum() / k * (1 + slack))
+
+    labels = np.zeros(len(points), dtype=int)
+    for _ in range(iterations):
+        dist = np.sqrt(((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2))
+        ranked = np.sort(dist, axis=1)
+        regret = ranked[:, 1] - ranked[:, 0] if k > 1 else ranked[:, 0]
+        load = np.zeros(k)
+        new_labels = np.full(len(points), -1)
+        for i in np.argsort(-regret):
+            for c in np.argsort(dist[i]):
+                if load[c] + weights[i] <= limit:
+                    break
+            else:
+                c = int(np.argmin(load))
+            new_labels[i] = c
+            load[c] += weights[i]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            if (labels == c).any():
+                centers[c] = points[labels == c].mean(axis=0)
+    return labels, centers
+
+
+def _split_vehicles(demands, num_cars):
+    # 人数に比例して実車両を配分する (各クラスタ最低1台、最大剰余方式)
+    total = sum(demands)
+    shares = [max(1.0, num_cars * d / total) for d in demands]
+    counts = [int(s) for s in shares]
+    while sum(counts) > num_cars:
+        counts[counts.index(max(counts))] -= 1
+    for c in sorted(range(len(shares)), key=lambda c: counts[c] - shares[c]):
+        if sum(counts) >= num_cars:
+            break
+        counts[c] += 1
+    vehicles, offset = [], 0
+    for count in counts:
+        vehicles.append(list(range(offset, offset + count)))
+        offset += count
+    return vehicles
+
+
+def _pair_rounds(centers, rounds):
+    # 中心が近いクラスタ同士を組にする。ラウンドごとに別の組み合わせを選ぶ
+    k = len(centers)
+    candidates = sorted(
+        ((float(np.linalg.norm(centers[a] - centers[b])), a, b) for a in range(k) for b in range(a + 1, k)))
+    used, result = set(), []
+    for _ in range(rounds):
+        matched, pairs = set(), []
+        for _, a, b in candidates:
+            if a in matched or b in matched or (a, b) in used:
+                continue
+            pairs.append((a, b))
+            matched.update((a, b))
+            used.add((a, b))
+        if pairs:
+            result.append(pairs)
+    return result
+
+
+def plan_clusters(data, config):
+    # 戻り値: {'clusters': [[ノード]], 'vehicles': [[実車両番号]], 'pairs': [[(a, b)] ラウンドごと]}
+    # 1クラスタで足りる規模なら None
+    nodes = [n for n in range(len(data['locations'])) if n != data['depot']]
+    k = min(data['real_vehicle_count'], math.ceil(len(nodes) / config.get('cluster_size', CLUSTER_SIZE)))
+    if k < 2:
+        return None
+
+    features = _node_features(data, config.get('deadline_weight', DEADLINE_WEIGHT_KM))
+    weights = np.array([data['demands'][n] for n in nodes], dtype=np.float64)
+    labels, centers = _balanced_kmeans(features[nodes], weights, k)
+    clusters = [[n for n, label in zip(nodes, labels) if label == c] for c in range(k)]
+    keep = [c for c in range(k) if clusters[c]]
+    clusters, centers = [clusters[c] for c in keep], centers[keep]
+    vehicles = _split_vehicles([sum(data['demands'][n] for n in cluster) for cluster in clusters], data['real_vehicle_count'])
+    pairs = _pair_rounds(centers, config.get('improvement_rounds', IMPROVEMENT_ROUNDS))
+    sizes = ", ".join(f"{len(cluster)}地点/{len(cars)}台" for cluster, cars in zip(clusters, vehicles))
+    print(f"分割計算: {len(clusters)} クラスタ ({sizes})")
+    return {'clusters': clusters, 'vehicles': vehicles, 'pairs': pairs}
+
+
+def required_cells(plan, depot=0):
+    # 分割計算で実際に使う行列の要素 (クラスタ内・拠点との往復・改善で組にするクラスタ間)
+    groups = [[depot] + cluster for cluster in plan['clusters']]
+    for pairs in plan['pairs']:
+        for a, b in pairs:
+            groups.append([depot] + plan['clusters'][a] + plan['clusters'][b])
+    cells = set()
+    for group in groups:
+        cells.update((i, j) for i in group for j in group if i != j)
+    return cells
+
+
+def subproblem(data, nodes, num_cars, trips=None):
+    # nodes (拠点以外) と num_cars 台だけの data を作る。児童名の行番号 (node_members) は元のまま
+    index = [data['depot']] + list(nodes)
+    demand = sum(data['demands'][n] for n in nodes)
+    sub = {
+        'names': data['names'],
+        'location_names': data['location_names'],
+        'node_members': [data['node_members'][n] for n in index],
+        'locations': [data['locations'][n] for n in index],
+        'time_matrix': np.asarray(data['time_matrix'])[np.ix_(index, index)],
+        'time_windows': [data['time_windows'][n] for n in index],
+        'demands': [data['demands'][n] for n in index],
+        'depot': 0,
+        'service_time': data['service_time'],
+        'real_vehicle_count': num_cars,
+        'capacity': data['capacity'],
+        'min_trips': max(1, math.ceil(demand / (num_cars * data['capacity']))),
+        'max_trips': data['max_trips'],
+    }
+    set_vehicle_pool(sub, trips or min(sub['min_trips'], sub['max_trips']))
+    return sub, index
+
+
+def solve_cluster(sub, config):
+    # 別プロセスで1クラスタを解く (クラスタごとのログは表示せず、結果の要約だけを親プロセスで表示する)
+    started = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = solve_data_model(sub, config, cancel_event=worker_cancel_event())
+    return {
+        'objective': result[0] if result else None,
+        'routes': result[1] if result else None,
+        'trips': sub['trips'],
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+
+def improve_pair(sub, initial_routes, initial_objective, time_limit):
+    # 2クラスタ分の現在の解から局所探索 (GLS) を行い、良くなった時だけ返す
+    started = time.monotonic()
+    manager, routing = build_routing_model(sub)
+    add_cancel_limit(routing, worker_cancel_event())
+    initial = routing.ReadAssignmentFromRoutes(
+        [[manager.NodeToIndex(node) for node in route] for route in initial_routes], True)
+    if not initial:
+        return None
+    search_parameters = make_search_parameters('PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH', time_limit)
+    solution = routing.SolveFromAssignmentWithParameters(initial, search_parameters)
+    if not solution or solution.ObjectiveValue() >= initial_objective:
+        return None
+    return {
+        'objective': solution.ObjectiveValue(),
+        'routes': extract_routes(sub, manager, routing, solution),
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+
+def _to_global(route, index, cars, num_cars):
+    # 部分問題の車両番号・ノード番号を全体の番号に戻す
+    local_count = len(cars)
+    trip, real = divmod(route['vehicle_id'], local_count)
+    return {
+        'vehicle_id': trip * num_cars + cars[real],
+        'nodes': [index[node] for node in route['nodes']],
+        'arrivals': route['arrivals'],
+    }
+
+
+def _to_local(routes, index, cars, num_cars, num_local_vehicles):
+    # 全体の番号のルートを部分問題の「車両ごとの訪問ノード列」(拠点を除く) に変換する
+    position = {node: k for k, node in enumerate(index)}
+    local = [[] for _ in range(num_local_vehicles)]
+    for route in routes:
+        trip, real = divmod(route['vehicle_id'], num_cars)
+        local[trip * len(cars) + cars.index(real)] = [position[node] for node in route['nodes'][1:-1]]
+    return local
+
+
+def _pick_donor(results, vehicles, received):
+    # 車両1台あたりの目的値が最も小さい (余裕のある) クラスタから1台を借りる
+    candidates = [c for c, result in enumerate(results)
+                  if result['objective'] is not None and len(vehicles[c]) > 1 and c not in received]
+    return min(candidates, key=lambda c: results[c]['objective'] / len(vehicles[c]), default=None)
+
+
+def solve_decomposed(data, config, progress_callback=None, cancel_event=None, telemetry=None):
+    # 戻り値: (目的値, 車両ごとのルート) / 解なしなら None (solve_data_model と同じ)
+    telemetry = telemetry or RunTelemetry()
+    started = time.monotonic()
+    plan = data['decomposition']
+    num_cars = data['real_vehicle_count']
+    clusters = plan['clusters']
+    vehicles = [list(cars) for cars in plan['vehicles']]
+    workers = min(len(clusters), config.get('decompose_workers') or multiprocessing.cpu_count() or 1)
+    time_limit = config.get('time_limit', 60)
+    # クラスタの探索時間: 全体の時間制限に収まるように、同時に解けるクラスタ数で割り振る
+    cluster_time_limit = config.get('cluster_time_limit') or max(1, time_limit * workers // len(clusters))
+    # クラスタは小さいので、初期解が1秒で見つからなければ車両が足りないとみなす
+    cluster_config = {'time_limit': cluster_time_limit, 'probe_time_limit': CLUSTER_PROBE_TIME_LIMIT}
+
+    print(f"分割計算: {len(clusters)} クラスタを {workers} プロセスで計算中 (各 {cluster_time_limit} 秒)...")
+    with cancellable_process_pool(workers, cancel_event) as pool:
+        with telemetry.phase('cluster_solve'):
+            subs = [subproblem(data, cluster, len(cars)) for cluster, cars in zip(clusters, vehicles)]
+            results = list(pool.map(solve_cluster, [sub for sub, _ in subs], [cluster_config] * len(subs)))
+
+            # 車両の配分は人数比なので、到着期限の厳しいクラスタでは足りないことがある。
+            # 解けなかったクラスタには余裕のあるクラスタから1台ずつ移し、両方を解き直す
+            received, repairs = set(), 0
+            while any(result['objective'] is None for result in results) and repairs < len(clusters):
+                if is_cancelled(cancel_event):
+                    break
+                retry = []
+                for target in [c for c, result in enumerate(results) if result['objective'] is None]:
+                    donor = _pick_donor(results, vehicles, received | set(retry))
+                    if donor is None:
+                        break
+                    vehicles[target].append(vehicles[donor].pop())
+                    received.add(target)
+                    retry += [target, donor]
+                    repairs += 1
+                    print(f"  クラスタ {target + 1} の車両が足りないため、クラスタ {donor + 1} から1台移して解き直します")
+                if not retry:
+                    break
+                for c in retry:
+                    subs[c] = subproblem(data, clusters[c], len(vehicles[c]))
+                retried = pool.map(solve_cluster, [subs[c][0] for c in retry], [cluster_config] * len(retry))
+                for c, result in zip(retry, retried):
+                    results[c] = result
+            telemetry.set_solver(cluster_repairs=repairs)
+
+        failed = [c for c, result in enumerate(results) if result['objective'] is None]
+        if failed and is_cancelled(cancel_event):
+            print("計算を中止しました (全クラスタの解がそろう前に中止されました)")
+            telemetry.set_solver(status='cancelled', mode='decomposed')
+            return None
+        if failed:
+            print(f"⚠️ {len(failed)} クラスタで解が見つからないため、分割せずに計算します")
+            telemetry.set_solver(decomposition_failed_clusters=len(failed))
+            return None
+
+        # 全体の解 (クラスタごとの目的値と、全体の番号に戻したルート)
+        objectives = [result['objective'] for result in results]
+        routes_by_cluster = [
+            [_to_global(route, index, cars, num_cars) for route in result['routes']]
+            for result, (_, index), cars in zip(results, subs, vehicles)
+        ]
+        for c, result in enumerate(results):
+            print(f"  クラスタ {c + 1}: {len(clusters[c])} 地点 / {len(vehicles[c])} 台 × {result['trips']} 便 / "
+                  f"目的値 {result['objective']} ({result['seconds']} 秒)")
+        before = sum(objectives)
+        if progress_callback:
+            progress_callback(before)
+
+        with telemetry.phase('cross_improve'):
+            for round_index, pairs in enumerate(plan['pairs']):
+                if is_cancelled(cancel_event):
+                    break
+                # 時間制限の残りを、残りのラウンドとワーカー1つあたりの組数で割り振る
+                remaining = time_limit - (time.monotonic() - started)
+                waves = math.ceil(len(pairs) / workers)
+                pair_time_limit = config.get('pair_time_limit') or int(remaining / (len(plan['pairs']) - round_index) / waves)
+                if pair_time_limit < 1:
+                    break
+                jobs = []
+                for a, b in pairs:
+                    # 各クラスタの担当車両が回っている地点を、そのクラスタの地点とみなす
+                    routes = routes_by_cluster[a] + routes_by_cluster[b]
+                    nodes = [n for route in routes for n in route['nodes'][1:-1]]
+                    cars = vehicles[a] + vehicles[b]
+                    trips = max(route['vehicle_id'] // num_cars + 1 for route in routes)
+                    sub, index = subproblem(data, nodes, len(cars), trips)
+                    initial = _to_local(routes, index, cars, num_cars, sub['num_vehicles'])
+                    jobs.append((a, b, sub, index, cars, initial))
+                improved = list(pool.map(
+                    improve_pair, [job[2] for job in jobs], [job[5] for job in jobs],
+                    [objectives[job[0]] + objectives[job[1]] for job in jobs], [pair_time_limit] * len(jobs)))
+                for (a, b, sub, index, cars, _), result in zip(jobs, improved):
+                    if result is None:
+                        continue
+                    merged = [_to_global(route, index, cars, num_cars) for route in result['routes']]
+                    routes_by_cluster[a] = [route for route in merged if route['vehicle_id'] % num_cars in vehicles[a]]
+                    routes_by_cluster[b] = [route for route in merged if route['vehicle_id'] % num_cars in vehicles[b]]
+                    # 2クラスタの目的値は合計だけが分かるので、改善分は a に計上する
+                    objectives[a] = result['objective'] - objectives[b]
+                if progress_callback:
+                    progress_callback(sum(objectives))
+
+    total = sum(objectives)
+    routes = sorted((route for cluster_routes in routes_by_cluster for route in cluster_routes), key=lambda route: route['vehicle_id'])
+    set_vehicle_pool(data, max(route['vehicle_id'] // num_cars + 1 for route in routes))
+    print(f"分割計算: 目的値 {before} -> {total} (クラスタ間の改善)")
+    telemetry.set_solver(
+        mode='decomposed', status='solved', objective=total, clusters=len(clusters),
+        cluster_sizes=[len(cluster) for cluster in clusters], cluster_vehicles=[len(cars) for cars in vehicles],
+        cluster_objective=before, cluster_seconds=[result['seconds'] for result in results],
+    )
+    return total, routes
@@ -0,0 +1,127 @@
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from telemetry import RunTelemetry
+
+# ==========================================
+# バックグラウンド計算ジョブ
+# ==========================================
+
+# 結果を待つセッションは画面の更新 (1秒ごと) のたびに subscribe し直す。これより長く更新がなければ
+# タブを閉じたものとみなし、中止の判断 (他に待っている人がいるか) から外す
+# (裏に回したタブはブラウザが更新を1分に1回ほどに間引くので、それより長くしておく)
+SUBSCRIBER_TIMEOUT_SECONDS = 90
+
+def job_key(roster, config):
+    # 名簿と設定が同じなら同じキー -> 同一計算を共有・再利用する
+    payload = json.dumps({'roster': roster, 'config': config}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class SolveJob:
+    def __init__(self, key, telemetry=None):
+        self.key = key
+        self.telemetry = telemetry or RunTelemetry(run_id=key)
+        self.status = 'queued'  # queued / running / done / failed / cancelled
+        self.progress = []  # [(経過秒, 目的値)] 改善した時だけ追加
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.subscribers = {}  # この計算の結果を待っているセッション -> 最後に画面を更新した時刻
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def best_objective(self):
+        with self.lock:
+            return self.progress[-1][1] if self.progress else None
+
+    def report_progress(self, objective):
+        with self.lock:
+            if not self.progress or objective < self.progress[-1][1]:
+                self.progress.append((round(self.elapsed(), 1), objective))
+
+    def subscribe(self, subscriber):
+        # 計算を依頼した時と、待っている画面を更新するたびに呼ぶ
+        with self.lock:
+            self.subscribers[subscriber] = time.time()
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.pop(subscriber, None)
+
+    def active_subscribers(self):
+        cutoff = time.time() - SUBSCRIBER_TIMEOUT_SECONDS
+        with self.lock:
+            return [subscriber for subscriber, seen in self.subscribers.items() if seen >= cutoff]
+
+    def cancel(self, subscriber=None):
+        # 同じ計算を他のセッションも待っている間は、そのセッションが待つのをやめるだけで計算は続ける。
+        # 最後の1人 (タブを閉じたセッションは数えない) が中止した時だけ探索を打ち切る。戻り値: 計算を中止したか
+        self.unsubscribe(subscriber)
+        if self.active_subscribers():
+            return False
+        self.cancel_event.set()
+        return True
+
+
+class JobManager:
+    def __init__(self, max_workers=2, max_finished=20):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="solve-job")
+        self.jobs = {}
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.jobs.get(key)
+
+    def submit(self, key, fn, *args, telemetry=None, subscriber=None, **kwargs):
+        # 実行中・完了済みの同一ジョブがあればそれを返す (失敗・中止したもの、中止の途中のものは再実行)
+        # subscriber: 結果を待つセッションの識別子。全員が中止した時だけ計算を打ち切る。
+        # 同じセッションが別の条件で計算し直したら、前のジョブの待ち人数からは外す
+        # fn には progress_callback / cancel_event / telemetry がキーワード引数で渡される
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None or job.status in ('failed', 'cancelled') or job.cancel_event.is_set():
+                job = SolveJob(key, telemetry)
+                self.jobs[key] = job
+                self._evict_finished()
+                self.pool.submit(self._run, job, fn, args, kwargs)
+            others = [other for other in self.jobs.values() if other is not job]
+        for other in others:
+            other.unsubscribe(subscriber)
+        job.subscribe(subscriber)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            result = fn(*args, progress_callback=job.report_progress, cancel_event=job.cancel_event,
+                        telemetry=job.telemetry, **kwargs)
+            job.result = result
+            job.status = 'cancelled' if job.cancel_event.is_set() else 'done'
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    def _evict_finished(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[: max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job.key]
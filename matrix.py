@@ -0,0 +1,181 @@
+import numpy as np
+from route_cache import TravelTimeCache, coord_key
+
+# ==========================================
+# 移動時間行列 (Google Maps API / 簡易計算)
+# ==========================================
+
+def get_distance_matrix_batched(locations, api_key, cache=None, time_bucket="", fetcher=None, telemetry=None,
+                                cells=None, fallback=None):
+    # cells: 取得する (出発, 到着) の組 (省略時は全要素)。それ以外の要素は fallback の行列の値を使う
+    num_locs = len(locations)
+    if cache is None:
+        cache = TravelTimeCache()
+    key_func = cache.key if cache else coord_key
+    keys = [key_func(loc) for loc in locations]
+
+    # キャッシュ済みの組み合わせを埋め、未取得の組み合わせだけを出発地ごとにまとめる
+    cached = cache.get_many(keys, time_bucket) if cache else {}
+    matrix = np.asarray(fallback).tolist() if fallback is not None else [[0] * num_locs for _ in range(num_locs)]
+    cells = sorted(cells) if cells is not None else ((i, j) for i in range(num_locs) for j in range(num_locs))
+    missing = {}
+    hits = 0
+    for i, j in cells:
+        if i == j or keys[i] == keys[j]:
+            matrix[i][j] = 0
+            continue
+        minutes = cached.get((keys[i], keys[j]))
+        if minutes is None:
+            missing.setdefault(i, []).append(j)
+        else:
+            matrix[i][j] = minutes
+            hits += 1
+    misses = sum(len(dests) for dests in missing.values())
+    if cache:
+        cache.hits += hits
+        cache.misses += misses
+    print(f"経路キャッシュ: ヒット {hits} 要素 / ミス {misses} 要素")
+    if telemetry:
+        telemetry.count('matrix_cache_hits', hits)
+        telemetry.count('matrix_cache_misses', misses)
+    if not missing:
+        return matrix
+
+    print(f"Google Maps APIで {len(missing)} 地点 ({misses}要素) のルート情報を取得中...")
+    from matrix_fetcher import DistanceMatrixFetcher, FAILED_MINUTES
+    if fetcher is None:
+        fetcher = DistanceMatrixFetcher(api_key)
+    requested = [(i, j) for i, dests in missing.items() for j in dests]
+    report = fetcher.fetch(locations, requested)
+    fetched = {}
+    for (i, j), minutes in report.durations.items():
+        matrix[i][j] = minutes
+        fetched[(keys[i], keys[j])] = minutes
+    for (i, j) in report.failed:
+        matrix[i][j] = FAILED_MINUTES
+    print(f"API取得結果: {report.summary()}")
+    if telemetry:
+        for seconds, ok in report.latencies:
+            telemetry.record_http('distance_matrix', seconds, ok)
+        telemetry.count('distance_matrix_elements', len(requested))
+        telemetry.count('distance_matrix_failed_elements', len(report.failed))
+    if report.failed:
+        print("⚠️ 取得に失敗した要素 (9999分として扱います):")
+        for (i, j), reason in list(report.failed.items())[:10]:
+            print(f"  {i} -> {j}: {reason}")
+        if len(report.failed) > 10:
+            print(f"  ...ほか {len(report.failed) - 10} 要素")
+
+    # 取得に失敗した要素 (9999) はキャッシュしない
+    if cache and fetched:
+        cache.put_many(fetched, time_bucket)
+    print("APIデータ取得完了！")
+    return matrix
+
+def haversine_km_matrix(locations):
+    # 全地点間の直線距離 (km)
+    coords = np.radians(np.asarray(locations, dtype=np.float64).reshape(-1, 2))
+    lat, lon = coords[:, 0], coords[:, 1]
+    dlat = lat[None, :] - lat[:, None]
+    dlon = lon[None, :] - lon[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def calculate_haversine_matrix(locations, speed_kmh=20.0, speed_model=None, detour_factor=1.0, dtype=np.int32):
+    # speed_model: [(距離上限km, 時速km), ...] の区間ごとの速度 (例: 近距離ほど遅い)
+    # detour_factor: 直線距離に掛ける迂回係数。地点ごとの配列なら両端の平均を使う
+    print("簡易計算モードで実行します...")
+    dist_km = haversine_km_matrix(locations)
+
+    factor = np.asarray(detour_factor, dtype=np.float64)
+    if factor.ndim == 1:
+        factor = (factor[:, None] + factor[None, :]) / 2
+    dist_km = dist_km * factor
+
+    if speed_model:
+        limits = np.array([band[0] for band in speed_model], dtype=np.float64)
+        speeds = np.array([band[1] for band in speed_model], dtype=np.float64)
+        band_index = np.minimum(np.searchsorted(limits, dist_km), len(speeds) - 1)
+        speed = speeds[band_index]
+    else:
+        speed = speed_kmh
+
+    minutes = np.rint(dist_km / speed * 60)
+    np.fill_diagonal(minutes, 0)
+    return np.clip(minutes, 0, np.iinfo(dtype).max).astype(dtype)
+
+# ==========================================
+# 近隣だけを取得する疎な行列 (API の要素数を N² から約 N·k に減らす)
+# ==========================================
+
+SPARSE_NEIGHBORS = 10  # 各地点について実際の移動時間を取得する近い地点の数
+
+def knn_cells(locations, k=SPARSE_NEIGHBORS, depot=0, dist_km=None):
+    # 各地点から近い k 地点への往復と、拠点との往復の組を返す
+    if dist_km is None:
+        dist_km = haversine_km_matrix(locations)
+    num_locs = len(dist_km)
+    cells = set()
+    for i in range(num_locs):
+        cells.update(((depot, i), (i, depot)))
+        order = np.argsort(dist_km[i], kind='stable')
+        for j in order[:k + 1]:
+            j = int(j)
+            if j != i:
+                cells.update(((i, j), (j, i)))
+    cells.discard((depot, depot))
+    return cells
+
+def fit_travel_time_model(dist_km, matrix, cells, failed_minutes=None):
+    # 取得できた組の (直線距離, 移動時間) に 分 = a + b × km を最小二乗で当てはめる
+    pairs = [(i, j) for i, j in cells if i != j and matrix[i][j] != failed_minutes]
+    if len(pairs) < 2:
+        return None
+    x = np.array([dist_km[i][j] for i, j in pairs])
+    y = np.array([matrix[i][j] for i, j in pairs], dtype=np.float64)
+    if np.ptp(x) == 0:
+        return None
+    slope, intercept = np.polyfit(x, y, 1)
+    if slope <= 0:
+        # 距離に比例しない結果 (ほぼ同じ距離ばかりなど) は原点を通る直線で代用する
+        slope, intercept = float(y.sum() / x.sum()), 0.0
+    residual = y - (intercept + slope * x)
+    # 推定した要素は到着期限の判定にも使うので、実際より短く見積もらないよう残差の上側 (90%) を足す
+    return {'intercept': float(intercept), 'slope': float(slope), 'margin': float(max(np.percentile(residual, 90), 0)),
+            'pairs': len(pairs), 'mae': float(np.abs(residual).mean())}
+
+def get_sparse_distance_matrix(locations, api_key, k=SPARSE_NEIGHBORS, depot=0, cells=None, cache=None,
+                               time_bucket="", fetcher=None, telemetry=None, speed_kmh=20.0):
+    # 近隣 (と拠点との往復) だけを API で取得し、残りは取得結果から較正した直線距離の推定で埋める
+    # cells: さらに絞り込む場合に、使う可能性のある組 (分割計算のクラスタ内など)
+    # 戻り値: (行列, 推定値の要素を True とする N×N の bool 配列)。取得に失敗した要素も推定値で埋める
+    dist_km = haversine_km_matrix(locations)
+    requested = knn_cells(locations, k, depot, dist_km)
+    if cells is not None:
+        requested &= set(cells)
+    num_locs = len(locations)
+    print(f"近隣 {k} 地点のみ取得します: {len(requested)} / {num_locs * (num_locs - 1)} 要素")
+    matrix = get_distance_matrix_batched(locations, api_key, cache=cache, time_bucket=time_bucket,
+                                         fetcher=fetcher, telemetry=telemetry, cells=requested)
+
+    from matrix_fetcher import FAILED_MINUTES
+    model = fit_travel_time_model(dist_km, matrix, requested, FAILED_MINUTES)
+    if model is None:
+        print(f"⚠️ 推定に使える取得結果がないため、時速 {speed_kmh} km の直線距離で埋めます")
+        model = {'intercept': 0.0, 'slope': 60.0 / speed_kmh, 'margin': 0.0, 'pairs': 0, 'mae': None}
+    else:
+        print(f"推定式: 分 = {model['intercept']:.2f} + {model['slope']:.2f} × km + 余裕 {model['margin']:.1f} "
+              f"({model['pairs']} 組から推定, 平均誤差 {model['mae']:.1f} 分)")
+    estimate = np.rint(np.maximum(model['intercept'] + model['margin'] + model['slope'] * dist_km, 0)).astype(np.int64)
+    matrix = np.asarray(matrix, dtype=np.int64)
+    fetched = np.zeros((num_locs, num_locs), dtype=bool)
+    for i, j in requested:
+        fetched[i, j] = True
+    # 取得に失敗した要素 (9999) のままだとその区間が使えず、期限に間に合わなくなることがある
+    fetched &= matrix != FAILED_MINUTES
+    np.fill_diagonal(fetched, True)
+    result = np.where(fetched, matrix, estimate)
+    if telemetry:
+        telemetry.count('sparse_matrix_estimated_elements', int((~fetched).sum()))
+        telemetry.set_solver(travel_time_model=model)
+    return result.tolist(), ~fetched
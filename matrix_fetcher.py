@@ -0,0 +1,199 @@
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# ==========================================
+# Distance Matrix API 並列取得エンジン
+# ==========================================
+
+DISTANCE_MATRIX_URL = os.environ.get(
+    "DISTANCE_MATRIX_URL", "https://maps.googleapis.com/maps/api/distancematrix/json"
+)
+
+# API の1リクエストあたりの上限
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+FAILED_MINUTES = 9999
+RETRYABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+
+
+class RateLimiter:
+    # 全スレッド共通で秒間リクエスト数 (QPS) を制限する
+    def __init__(self, qps):
+        self.interval = 1.0 / qps if qps and qps > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class FetchReport:
+    def __init__(self):
+        self.durations = {}  # (i, j) -> 分
+        self.failed = {}  # (i, j) -> 失敗理由
+        self.requests = 0
+        self.retries = 0
+        self.elapsed = 0.0
+        self.latencies = []  # リクエストごとの (応答時間 秒, 成功したか)
+
+    def summary(self):
+        return (f"{self.requests} リクエスト / 成功 {len(self.durations)} 要素 / "
+                f"失敗 {len(self.failed)} 要素 / 再試行 {self.retries} 回 / {self.elapsed:.1f} 秒")
+
+
+def _tile_groups(groups, max_origins, max_destinations, max_elements):
+    blocks = []
+    for dests, origins in groups.items():
+        dests = sorted(dests)
+        origins = sorted(origins)
+        dest_chunk = min(len(dests), max_destinations, max_elements)
+        origin_chunk = max(1, min(max_origins, max_elements // dest_chunk))
+        for a in range(0, len(origins), origin_chunk):
+            for b in range(0, len(dests), dest_chunk):
+                blocks.append((origins[a : a + origin_chunk], dests[b : b + dest_chunk]))
+    return blocks
+
+
+def _valid_rows(data, num_origins, num_dests):
+    rows = data.get("rows")
+    if not isinstance(rows, list) or len(rows) != num_origins:
+        return False
+    for row in rows:
+        elements = row.get("elements") if isinstance(row, dict) else None
+        if not isinstance(elements, list) or len(elements) != num_dests:
+            return False
+        if not all(isinstance(element, dict) for element in elements):
+            return False
+    return True
+
+
+def plan_blocks(cells, max_origins=MAX_ORIGINS, max_destinations=MAX_DESTINATIONS, max_elements=MAX_ELEMENTS):
+    # 取得が必要なセル (i, j) を、同じ行き先集合を持つ出発地ごとにまとめてブロックに分割する
+    by_origin = {}
+    for i, j in cells:
+        by_origin.setdefault(i, set()).add(j)
+
+    # 行列全体の取得では対角 i -> i を行き先集合に含めた方が揃ってブロック数が減るので、
+    # 対角を含めない/含める両方で分割し、リクエスト数が少ない方を採用する
+    plans = []
+    for with_diagonal in (False, True):
+        groups = {}
+        for i, dests in by_origin.items():
+            key = frozenset(dests | {i}) if with_diagonal else frozenset(dests)
+            groups.setdefault(key, []).append(i)
+        plans.append(_tile_groups(groups, max_origins, max_destinations, max_elements))
+    return min(plans, key=len)
+
+
+class DistanceMatrixFetcher:
+    def __init__(self, api_key, base_url=DISTANCE_MATRIX_URL, max_workers=8, qps=20,
+                 max_retries=4, backoff_base=0.5, timeout=10, session=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.limiter = RateLimiter(qps)
+        if session is None:
+            # Keep-Alive で接続を使い回す
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def _backoff(self, attempt):
+        time.sleep(self.backoff_base * (2 ** attempt) * (1 + random.random()))
+
+    def _request_block(self, locations, origins, dests, report, lock):
+        params = {
+            "units": "metric",
+            "origins": "|".join(f"{locations[i][0]},{locations[i][1]}" for i in origins),
+            "destinations": "|".join(f"{locations[j][0]},{locations[j][1]}" for j in dests),
+            "key": self.api_key,
+        }
+        reason = ""
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                with lock:
+                    report.retries += 1
+                self._backoff(attempt - 1)
+            self.limiter.wait()
+            with lock:
+                report.requests += 1
+            sent = time.monotonic()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                with lock:
+                    report.latencies.append((time.monotonic() - sent, False))
+                reason = f"通信エラー: {type(e).__name__}"
+                continue
+            with lock:
+                report.latencies.append((time.monotonic() - sent, response.status_code == 200))
+            if response.status_code == 429 or response.status_code >= 500:
+                reason = f"HTTP {response.status_code}"
+                continue
+            try:
+                data = response.json()
+            except ValueError:
+                reason = f"不正な応答 (HTTP {response.status_code})"
+                continue
+            status = data.get("status", "") if isinstance(data, dict) else ""
+            if status in RETRYABLE_STATUSES:
+                reason = status
+                continue
+            if status == "OK" and not _valid_rows(data, len(origins), len(dests)):
+                # status は OK でも rows / elements が欠けた応答は、一時的なエラーと同じく再試行する
+                reason = f"不正な応答 (HTTP {response.status_code})"
+                continue
+            if status != "OK":
+                # REQUEST_DENIED などは再試行しても結果が変わらない
+                return {}, {(i, j): status or f"HTTP {response.status_code}" for i in origins for j in dests if i != j}
+
+            durations, failed = {}, {}
+            for i, row in zip(origins, data["rows"]):
+                for j, element in zip(dests, row["elements"]):
+                    if i == j:
+                        continue
+                    duration = element.get("duration")
+                    seconds = duration.get("value") if isinstance(duration, dict) else None
+                    if element.get("status") == "OK" and isinstance(seconds, (int, float)):
+                        durations[(i, j)] = round(seconds / 60)
+                    else:
+                        failed[(i, j)] = element.get("status", "UNKNOWN")
+            return durations, failed
+        return {}, {(i, j): reason for i in origins for j in dests if i != j}
+
+    def fetch(self, locations, cells):
+        report = FetchReport()
+        blocks = plan_blocks(cells)
+        if not blocks:
+            return report
+        start = time.monotonic()
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._request_block, locations, o, d, report, lock) for o, d in blocks]
+            for n, future in enumerate(as_completed(futures), 1):
+                durations, failed = future.result()
+                report.durations.update(durations)
+                report.failed.update(failed)
+                if n % 10 == 0 or n == len(blocks):
+                    print(f"進捗: {n}/{len(blocks)} ブロック完了")
+        report.elapsed = time.monotonic() - start
+        return report
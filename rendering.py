@@ -0,0 +1,376 @@
+import os
+import json
+import math
+import time
+import hashlib
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from route_cache import RouteGeometryCache, coord_key, CACHE_TTL_SECONDS
+from data_source import format_minutes_to_time
+from telemetry import RunTelemetry
+
+# folium / pandas / requests は描画する時だけ読み込む
+
+# ==========================================
+# 1. 道路経路 (OSRM)
+# ==========================================
+
+OSRM_BASE_URL = os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org")
+PUBLIC_OSRM_HOST = "router.project-osrm.org"  # 公開デモサーバーは 1 秒に 1 リクエストまで
+PUBLIC_OSRM_QPS = 1.0
+OSRM_QPS = float(os.environ.get("OSRM_QPS", "0"))  # 0: 公開サーバーなら PUBLIC_OSRM_QPS、自前のサーバーなら無制限
+
+def default_osrm_qps(base_url=OSRM_BASE_URL):
+    if OSRM_QPS > 0:
+        return OSRM_QPS
+    return PUBLIC_OSRM_QPS if PUBLIC_OSRM_HOST in base_url else 0
+
+def fetch_osrm_geometry(start_coords, end_coords, base_url=OSRM_BASE_URL, session=None, timeout=10):
+    # 取得できなかった場合は None (キャッシュしないため、直線への置き換えは呼び出し側で行う)
+    import requests
+    url = f"{base_url}/route/v1/driving/{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}?overview=full&geometries=geojson"
+    try:
+        response = (session or requests).get(url, timeout=timeout)
+        data = response.json()
+        coords = data['routes'][0]['geometry']['coordinates']
+        return [(lat, lon) for lon, lat in coords]
+    except Exception:
+        return None
+
+def get_osrm_route(start_coords, end_coords, base_url=OSRM_BASE_URL):
+    return fetch_osrm_geometry(start_coords, end_coords, base_url) or [start_coords, end_coords]
+
+def get_route_geometries(arcs, base_url=OSRM_BASE_URL, cache=None, max_workers=8, telemetry=None, qps=None,
+                         fallbacks=None):
+    # arcs: [(出発座標, 到着座標)] -> {(出発座標, 到着座標): 経路の座標列}
+    # 重複を除き、キャッシュにない区間だけを並列に取得する
+    # qps: 秒間リクエスト数の上限 (省略時は default_osrm_qps。公開サーバーは制限を超えると 429 で断られ、直線になる)
+    # fallbacks: set を渡すと、取得できず直線で代用した区間を追加する
+    if cache is None:
+        cache = RouteGeometryCache()
+    key_func = cache.key if cache else coord_key
+    unique_arcs = list(dict.fromkeys((tuple(a), tuple(b)) for a, b in arcs))
+    geometries = {}
+    pending = []
+    for arc in unique_arcs:
+        if key_func(arc[0]) == key_func(arc[1]):
+            geometries[arc] = [arc[0], arc[1]]
+        else:
+            pending.append(arc)
+
+    cached = cache.get_many([(key_func(a), key_func(b)) for a, b in pending]) if cache else {}
+    missing = []
+    for arc in pending:
+        points = cached.get((key_func(arc[0]), key_func(arc[1])))
+        if points is None:
+            missing.append(arc)
+        else:
+            geometries[arc] = points
+    if cache:
+        cache.hits += len(pending) - len(missing)
+        cache.misses += len(missing)
+    print(f"道路経路: {len(unique_arcs)} 区間 (キャッシュ {len(pending) - len(missing)} / 取得 {len(missing)})")
+    if telemetry:
+        telemetry.count('route_cache_hits', len(pending) - len(missing))
+        telemetry.count('route_cache_misses', len(missing))
+
+    from matrix_fetcher import RateLimiter
+    limiter = RateLimiter(default_osrm_qps(base_url) if qps is None else qps)
+
+    def fetch(arc):
+        limiter.wait()
+        sent = time.monotonic()
+        points = fetch_osrm_geometry(arc[0], arc[1], base_url, session)
+        if telemetry:
+            telemetry.record_http('osrm', time.monotonic() - sent, points is not None)
+        return points
+
+    fetched = {}
+    if missing:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = pool.map(fetch, missing)
+            for arc, points in zip(missing, results):
+                if points:
+                    geometries[arc] = points
+                    fetched[(key_func(arc[0]), key_func(arc[1]))] = points
+                else:
+                    geometries[arc] = [arc[0], arc[1]]
+                    if fallbacks is not None:
+                        fallbacks.add(arc)
+        session.close()
+    if cache and fetched:
+        cache.put_many(fetched)
+    return geometries
+
+# ==========================================
+# 2. 地図・運行表
+# ==========================================
+
+def get_vehicle_display_name(vehicle_id, real_count):
+    real_id = (vehicle_id % real_count) + 1
+    trip_id = (vehicle_id // real_count) + 1
+    return f"車両{real_id} (便{trip_id})", real_id
+
+VEHICLE_COLORS = ['blue', 'green', 'purple', 'orange', 'darkred', 'cadetblue', 'pink', 'darkgreen']
+
+def get_routes_geometries(data, routes, telemetry, fallbacks=None):
+    # 実際に使われた区間の道路経路だけを先にまとめて取得する (fallbacks: get_route_geometries を参照)
+    arcs = [
+        (data['locations'][a], data['locations'][b])
+        for route in routes for a, b in zip(route['nodes'][:-1], route['nodes'][1:])
+    ]
+    with telemetry.phase('route_geometry'):
+        if data.get('road_graph'):
+            # 移動時間を道路グラフで求めた場合は、経路も同じグラフからたどる (通信なし)
+            from road_graph import load_road_graph
+            return load_road_graph(data['road_graph']).route_geometries(arcs)
+        return get_route_geometries(arcs, telemetry=telemetry, fallbacks=fallbacks)
+
+def create_map_object(data, routes, telemetry=None):
+    import folium
+    telemetry = telemetry or RunTelemetry()
+    depot_loc = data['locations'][data['depot']]
+    m = folium.Map(location=depot_loc, zoom_start=13)
+    geometries = get_routes_geometries(data, routes, telemetry)
+
+    started = time.monotonic()
+    for route in routes:
+        display_name, real_id = get_vehicle_display_name(route['vehicle_id'], data['real_vehicle_count'])
+        color = VEHICLE_COLORS[(real_id - 1) % len(VEHICLE_COLORS)]
+        step = 1
+        for node_index, next_node_index in zip(route['nodes'][:-1], route['nodes'][1:]):
+            loc = data['locations'][node_index]
+
+            if node_index == data['depot']:
+                folium.Marker(loc, popup="拠点", icon=folium.Icon(color='red', icon='home')).add_to(m)
+            else:
+                # 同一地点の児童は1つのマーカーにまとめて表示
+                popup_lines = []
+                for member in data['node_members'][node_index]:
+                    popup_lines.append(f"{display_name}-{step}: {data['names'][member]} ({data['location_names'][member]})")
+                    step += 1
+                folium.Marker(loc, popup="<br>".join(popup_lines), icon=folium.Icon(color=color, icon='user')).add_to(m)
+
+            next_loc = data['locations'][next_node_index]
+            points = geometries[(tuple(loc), tuple(next_loc))]
+            folium.PolyLine(points, color=color, weight=3, opacity=0.8, tooltip=display_name).add_to(m)
+    telemetry.add_phase('map_render', time.monotonic() - started)
+    return m
+
+def create_schedule_df(data, routes, telemetry=None):
+    import pandas as pd
+    telemetry = telemetry or RunTelemetry()
+    started = time.monotonic()
+    rows = []
+    for route in routes:
+        display_name, _ = get_vehicle_display_name(route['vehicle_id'], data['real_vehicle_count'])
+        step = 1
+        for node_index, arrival_minutes in zip(route['nodes'][:-1], route['arrivals'][:-1]):
+            members = data['node_members'][node_index]
+
+            # 同一場所の児童は同時に到着し、乗降時間は最後の1人にまとめて計上
+            for k, member in enumerate(members):
+                is_last = k == len(members) - 1
+                service = data['service_time'] if (node_index != data['depot'] and is_last) else 0
+                rows.append({
+                    "車両名": display_name,
+                    "訪問順": step,
+                    "名前": data['names'][member],
+                    "場所名": data['location_names'][member],
+                    "到着予定時刻": format_minutes_to_time(arrival_minutes),
+                    "出発予定時刻": format_minutes_to_time(arrival_minutes + service),
+                    "滞在時間": service
+                })
+                step += 1
+
+        node_index = route['nodes'][-1]
+        arrival_minutes = route['arrivals'][-1]
+        rows.append({
+            "車両名": display_name,
+            "訪問順": step,
+            "名前": data['names'][node_index] + " (到着)",
+            "場所名": data['location_names'][node_index],
+            "到着予定時刻": format_minutes_to_time(arrival_minutes),
+            "出発予定時刻": "-",
+            "滞在時間": "-"
+        })
+    df = pd.DataFrame(rows)
+    df = df.astype(str)
+    telemetry.add_phase('schedule', time.monotonic() - started)
+    return df
+
+# ==========================================
+# 3. 軽量な地図 (車両ごとの GeoJSON・簡略化した経路・HTML のキャッシュ)
+# ==========================================
+
+MAP_CACHE_DIR = os.environ.get("MAP_CACHE_DIR", ".cache/maps")
+MAP_CACHE_MAX_FILES = int(os.environ.get("MAP_CACHE_MAX_FILES", "200"))  # 新しい順にこの数だけ残す
+SIMPLIFY_TOLERANCE_M = 10  # 経路の簡略化で許すずれ (m)
+
+def simplify_polyline(points, tolerance_m=SIMPLIFY_TOLERANCE_M):
+    # Douglas-Peucker 法で、元の線から tolerance_m 以上ずれない範囲で点を間引く
+    if len(points) <= 2:
+        return [tuple(p) for p in points]
+    lat0 = math.radians(points[0][0])
+    xy = [(lon * 111320.0 * math.cos(lat0), lat * 110540.0) for lat, lon in points]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        farthest, index = 0.0, None
+        for k in range(first + 1, last):
+            x, y = xy[k]
+            if length == 0:
+                distance = math.hypot(x - x1, y - y1)
+            else:
+                distance = abs(dy * (x - x1) - dx * (y - y1)) / length
+            if distance > farthest:
+                farthest, index = distance, k
+        if index is not None and farthest > tolerance_m:
+            keep[index] = True
+            stack.extend(((first, index), (index, last)))
+    return [tuple(p) for p, kept in zip(points, keep) if kept]
+
+def map_cache_key(data, routes, tolerance_m=SIMPLIFY_TOLERANCE_M):
+    # 地図の見た目を決めるもの (ルート・座標・吹き出しの名前・経路の取得元) のハッシュ
+    content = {
+        'routes': [(route['vehicle_id'], route['nodes']) for route in routes],
+        'locations': [list(loc) for loc in data['locations']],
+        'members': [[data['names'][i], data['location_names'][i]] for members in data['node_members'] for i in members],
+        'real_vehicle_count': data['real_vehicle_count'],
+        'road_graph': data.get('road_graph'),
+        'osrm': OSRM_BASE_URL,
+        'tolerance_m': tolerance_m,
+    }
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+
+def build_vehicle_layers(data, routes, geometries, tolerance_m=SIMPLIFY_TOLERANCE_M):
+    # 車両 (便) ごとに1つの GeoJSON: 経路全体を1本の LineString、各地点を Point にする
+    layers = []
+    for route in routes:
+        display_name, real_id = get_vehicle_display_name(route['vehicle_id'], data['real_vehicle_count'])
+        line = []
+        features = []
+        step = 1
+        for node_index, next_node_index in zip(route['nodes'][:-1], route['nodes'][1:]):
+            loc, next_loc = data['locations'][node_index], data['locations'][next_node_index]
+            points = geometries[(tuple(loc), tuple(next_loc))]
+            line.extend(points if not line else points[1:])
+            if node_index == data['depot']:
+                continue
+            popup_lines = []
+            for member in data['node_members'][node_index]:
+                popup_lines.append(f"{display_name}-{step}: {data['names'][member]} ({data['location_names'][member]})")
+                step += 1
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [round(loc[1], 5), round(loc[0], 5)]},
+                'properties': {'popup': "<br>".join(popup_lines)},
+            })
+        coordinates = [[round(lon, 5), round(lat, 5)] for lat, lon in simplify_polyline(line, tolerance_m)]
+        features.insert(0, {
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+            'properties': {'popup': display_name},
+        })
+        layers.append((display_name, VEHICLE_COLORS[(real_id - 1) % len(VEHICLE_COLORS)],
+                       {'type': 'FeatureCollection', 'features': features}))
+    return layers
+
+def create_light_map_object(data, routes, telemetry=None, tolerance_m=SIMPLIFY_TOLERANCE_M, fallbacks=None):
+    # create_map_object と同じ内容を、車両ごとの FeatureGroup (GeoJSON 1つ) で描く
+    import folium
+    telemetry = telemetry or RunTelemetry()
+    depot_loc = data['locations'][data['depot']]
+    m = folium.Map(location=depot_loc, zoom_start=13)
+    geometries = get_routes_geometries(data, routes, telemetry, fallbacks)
+
+    started = time.monotonic()
+    folium.Marker(depot_loc, popup="拠点", icon=folium.Icon(color='red', icon='home')).add_to(m)
+    for display_name, color, collection in build_vehicle_layers(data, routes, geometries, tolerance_m):
+        group = folium.FeatureGroup(name=display_name)
+        folium.GeoJson(
+            collection,
+            style_function=lambda feature, color=color: {'color': color, 'weight': 3, 'opacity': 0.8},
+            marker=folium.CircleMarker(radius=7, fill=True, fill_color=color, fill_opacity=0.9, color='white', weight=2),
+            popup=folium.GeoJsonPopup(fields=['popup'], labels=False),
+        ).add_to(group)
+        group.add_to(m)
+    folium.LayerControl(collapsed=True).add_to(m)
+    telemetry.add_phase('map_render', time.monotonic() - started)
+    return m
+
+def prune_map_cache(cache_dir=MAP_CACHE_DIR, max_files=MAP_CACHE_MAX_FILES, ttl_seconds=CACHE_TTL_SECONDS):
+    # 期限切れ (最後に使ってから ttl_seconds) の HTML と、新しい順に max_files を超えた分を消す
+    # 戻り値: 消したファイル数
+    entries = []
+    try:
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".html"):
+                with contextlib.suppress(OSError):  # 他のプロセスが先に消した
+                    entries.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        return 0
+    entries.sort(reverse=True)
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    for rank, (mtime, path) in enumerate(entries):
+        if rank >= max_files or mtime < cutoff:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+                removed += 1
+    return removed
+
+def save_map_cache(path, html):
+    # 同じプロセスの別セッション (スレッド) と一時ファイルが重ならないよう mkstemp で作ってから置き換える
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"地図のキャッシュ保存に失敗しました: {e}")
+        if tmp_path:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+def render_map_html(data, routes, telemetry=None, tolerance_m=SIMPLIFY_TOLERANCE_M, cache_dir=MAP_CACHE_DIR):
+    # 軽量な地図の HTML。同じ解なら保存済みの HTML を返す (経路の取得・描画をやり直さない)
+    telemetry = telemetry or RunTelemetry()
+    path = os.path.join(cache_dir, map_cache_key(data, routes, tolerance_m) + ".html")
+    try:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+    except OSError:
+        html = None  # 未保存か、他のプロセスが古い順に消した
+    if html is not None:
+        with contextlib.suppress(OSError):
+            os.utime(path)  # 使った順に残す
+        telemetry.count('map_cache_hits')
+    else:
+        fallbacks = set()
+        m = create_light_map_object(data, routes, telemetry, tolerance_m, fallbacks)
+        with telemetry.phase('map_render'):
+            html = m.get_root().render()
+        telemetry.count('map_cache_misses')
+        if fallbacks:
+            # 一時的に取得できず直線にした区間があれば保存しない (次回は経路を取得し直す)
+            print(f"道路経路を取得できなかった {len(fallbacks)} 区間を直線で描いたため、地図はキャッシュしません")
+        else:
+            save_map_cache(path, html)
+            telemetry.count('map_cache_evictions', prune_map_cache(cache_dir))
+    telemetry.count('map_payload_bytes', len(html.encode('utf-8')))
+    return html
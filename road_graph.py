@@ -0,0 +1,481 @@
+import os
+import sys
+import math
+import heapq
+import argparse
+import threading
+import numpy as np
+
+# ==========================================
+# オフラインの道路網 (OpenStreetMap) による移動時間・道路経路
+#   事前に地域の .osm から道路グラフを作って保存しておき (python road_graph.py map.osm)、
+#   計算時は配列 (CSR 形式) を読み込んで最短経路を求める。通信は行わない
+# ==========================================
+
+ROAD_GRAPH_PATH = os.environ.get("ROAD_GRAPH_PATH", ".cache/road_graph.npz")
+
+# 道路種別ごとの想定速度 (km/h)。maxspeed タグがあればそちらを優先する
+HIGHWAY_SPEEDS = {
+    'motorway': 60, 'motorway_link': 40, 'trunk': 45, 'trunk_link': 30,
+    'primary': 35, 'primary_link': 25, 'secondary': 30, 'secondary_link': 25,
+    'tertiary': 25, 'tertiary_link': 20, 'unclassified': 20, 'residential': 18,
+    'living_street': 8, 'service': 10, 'road': 15,
+}
+SNAP_SPEED_KMH = 10.0  # 地点から最寄りの道路までの直線部分の速度
+UNREACHABLE_MINUTES = 9999  # 到達できない組 (matrix_fetcher.FAILED_MINUTES と同じ値)
+DIJKSTRA_CHUNK = 32  # 道路網上の最短時間を一度に求める出発地点の数
+NEAREST_GRID_NODES = 4  # 最寄りノード探索の格子の1マスあたりの平均ノード数
+
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def _segment_km(a, b):
+    # 隣り合う形状点の間の距離 (短いので平面近似)
+    dy = (b[0] - a[0]) * 111.0
+    dx = (b[1] - a[1]) * 111.0 * math.cos(math.radians((a[0] + b[0]) / 2))
+    return math.hypot(dx, dy)
+
+
+def _parse_maxspeed(value):
+    # "40" / "40 km/h" / "25 mph" -> km/h (読めなければ None)
+    if not value:
+        return None
+    number = value.split()[0].split(';')[0]
+    try:
+        speed = float(number)
+    except ValueError:
+        return None
+    return speed * 1.609 if 'mph' in value else speed
+
+
+def _way_direction(tags):
+    # 1: 描かれた向きのみ / -1: 逆向きのみ / 0: 両方向
+    oneway = tags.get('oneway', '')
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    if oneway == 'no':
+        return 0
+    if tags.get('junction') == 'roundabout' or tags.get('highway') == 'motorway':
+        return 1
+    return 0
+
+
+def read_osm_ways(path):
+    # 1回目の読み込み: 車が通れる道路 (way) のノード列・速度・向き
+    import xml.etree.ElementTree as ET
+    ways = []
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+            highway = tags.get('highway')
+            if highway in HIGHWAY_SPEEDS and tags.get('access') not in ('no', 'private'):
+                refs = [int(nd.get('ref')) for nd in elem.iter('nd')]
+                speed = _parse_maxspeed(tags.get('maxspeed')) or HIGHWAY_SPEEDS[highway]
+                if len(refs) >= 2:
+                    ways.append((refs, speed, _way_direction(tags)))
+            elem.clear()
+        elif elem.tag in ('relation', 'node'):
+            elem.clear()
+    return ways
+
+
+def read_osm_nodes(path, wanted):
+    # 2回目の読み込み: 道路に使われているノードの座標だけ
+    import xml.etree.ElementTree as ET
+    coords = {}
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            node_id = int(elem.get('id'))
+            if node_id in wanted:
+                coords[node_id] = (float(elem.get('lat')), float(elem.get('lon')))
+            elem.clear()
+        elif elem.tag in ('way', 'relation'):
+            elem.clear()
+    return coords
+
+
+def _largest_strong_component(num_nodes, indptr, indices):
+    # Kosaraju 法 (再帰を使わない深さ優先探索)。一方通行の行き止まり等で行き来できない部分を除くため
+    order, seen = [], [False] * num_nodes
+    for root in range(num_nodes):
+        if seen[root]:
+            continue
+        seen[root] = True
+        stack = [(root, indptr[root])]
+        while stack:
+            u, e = stack[-1]
+            if e < indptr[u + 1]:
+                stack[-1] = (u, e + 1)
+                v = indices[e]
+                if not seen[v]:
+                    seen[v] = True
+                    stack.append((v, indptr[v]))
+            else:
+                stack.pop()
+                order.append(u)
+
+    reverse = [[] for _ in range(num_nodes)]
+    for u in range(num_nodes):
+        for e in range(indptr[u], indptr[u + 1]):
+            reverse[indices[e]].append(u)
+    component = [-1] * num_nodes
+    sizes = []
+    for root in reversed(order):
+        if component[root] >= 0:
+            continue
+        label = len(sizes)
+        component[root] = label
+        stack, size = [root], 0
+        while stack:
+            u = stack.pop()
+            size += 1
+            for v in reverse[u]:
+                if component[v] < 0:
+                    component[v] = label
+                    stack.append(v)
+        sizes.append(size)
+    largest = int(np.argmax(sizes)) if sizes else 0
+    return np.array(component) == largest
+
+
+class RoadGraph:
+    # ノード = 交差点と道路の端点。辺 = 交差点間の道路 (途中の形状点は geometry 配列に保持)
+    def __init__(self, lat, lon, indptr, indices, seconds, geometry_ptr, geometry_lat, geometry_lon):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.seconds = np.asarray(seconds, dtype=np.float32)
+        self.geometry_ptr = np.asarray(geometry_ptr, dtype=np.int64)
+        self.geometry_lat = np.asarray(geometry_lat, dtype=np.float64)
+        self.geometry_lon = np.asarray(geometry_lon, dtype=np.float64)
+        self._lists = None
+        self._edge_source = None
+        self._grid = None
+        self._csr = None
+
+    @property
+    def num_nodes(self):
+        return len(self.lat)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, lat, lon, sources, targets, seconds, geometries):
+        # geometries[辺] = 途中の形状点 [(lat, lon), ...]。出発ノード順に並べ替えて CSR にする
+        order = np.argsort(np.asarray(sources, dtype=np.int64), kind='stable')
+        sources = np.asarray(sources, dtype=np.int64)[order]
+        counts = np.bincount(sources, minlength=len(lat))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        points = [geometries[e] for e in order]
+        geometry_ptr = np.concatenate([[0], np.cumsum([len(p) for p in points])])
+        flat = [point for p in points for point in p]
+        return cls(lat, lon, indptr, np.asarray(targets)[order], np.asarray(seconds)[order], geometry_ptr,
+                   [p[0] for p in flat], [p[1] for p in flat])
+
+    def subgraph(self, keep):
+        # keep[ノード] が True のノードと、その間の辺だけを残す
+        new_index = np.cumsum(keep) - 1
+        edge_source = self.edge_source()
+        edge_keep = keep[edge_source] & keep[self.indices]
+        edges = np.flatnonzero(edge_keep)
+        geometries = [list(zip(self.geometry_lat[self.geometry_ptr[e]:self.geometry_ptr[e + 1]],
+                               self.geometry_lon[self.geometry_ptr[e]:self.geometry_ptr[e + 1]])) for e in edges]
+        return RoadGraph.from_edges(
+            self.lat[keep], self.lon[keep], new_index[edge_source[edges]], new_index[self.indices[edges]],
+            self.seconds[edges], geometries)
+
+    def save(self, path=ROAD_GRAPH_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(
+            path, lat=self.lat, lon=self.lon, indptr=self.indptr, indices=self.indices, seconds=self.seconds,
+            geometry_ptr=self.geometry_ptr, geometry_lat=self.geometry_lat, geometry_lon=self.geometry_lon)
+
+    @classmethod
+    def load(cls, path=ROAD_GRAPH_PATH):
+        with np.load(path) as f:
+            return cls(f['lat'], f['lon'], f['indptr'], f['indices'], f['seconds'],
+                       f['geometry_ptr'], f['geometry_lat'], f['geometry_lon'])
+
+    def edge_source(self):
+        if self._edge_source is None:
+            self._edge_source = np.repeat(np.arange(self.num_nodes), np.diff(self.indptr))
+        return self._edge_source
+
+    def _grid_index(self):
+        # 最寄りノード探索用の格子。1マスに平均 NEAREST_GRID_NODES 個ほどのノードが入る大きさにし、
+        # ノードをマス番号 (列 × 行数 + 行) 順に並べる -> 同じ列の連続したマスは1つの区間で取り出せる
+        if self._grid is None:
+            scale = math.cos(math.radians(float(self.lat.mean()))) if self.num_nodes else 1.0
+            x, y = self.lon * scale, self.lat
+            x0, y0 = float(x.min()), float(y.min())
+            area = max((float(x.max()) - x0) * (float(y.max()) - y0), 1e-12)
+            cell = max(math.sqrt(area / max(self.num_nodes, 1) * NEAREST_GRID_NODES), 1e-6)
+            nx = int((float(x.max()) - x0) / cell) + 1
+            ny = int((float(y.max()) - y0) / cell) + 1
+            keys = ((x - x0) // cell).astype(np.int64) * ny + ((y - y0) // cell).astype(np.int64)
+            order = np.argsort(keys, kind='stable')
+            starts = np.searchsorted(keys[order], np.arange(nx * ny + 1))
+            self._grid = (scale, x0, y0, cell, nx, ny, order, starts)
+        return self._grid
+
+    def nearest_nodes(self, locations):
+        # 各地点に最も近いノード番号と、そこまでの直線距離 (km)
+        # 地点のあるマスから外側へ1周ずつ広げて探し、見つけたノードより近いノードが外側にありえなくなったら止める
+        points = np.asarray(locations, dtype=np.float64).reshape(-1, 2)
+        scale, x0, y0, cell, nx, ny, order, starts = self._grid_index()
+        nodes = np.empty(len(points), dtype=np.int64)
+        for k, (lat, lon) in enumerate(points):
+            px, py = lon * scale, lat
+            cx, cy = math.floor((px - x0) / cell), math.floor((py - y0) / cell)
+            best, best_d2 = -1, math.inf
+            # 格子の外の地点は、格子に届く周から探し始める
+            first_ring = max(-cx, cx - (nx - 1), -cy, cy - (ny - 1), 0)
+            last_ring = max(cx, nx - 1 - cx, cy, ny - 1 - cy, 0)
+            for ring in range(first_ring, last_ring + 1):
+                # ring 周目以降のマスのノードは、地点から (ring - 1) マス分以上離れている
+                if best >= 0 and best_d2 <= ((ring - 1) * cell) ** 2:
+                    break
+                lo, hi = max(cy - ring, 0), min(cy + ring, ny - 1)
+                for ix in range(max(cx - ring, 0), min(cx + ring, nx - 1) + 1):
+                    if ix in (cx - ring, cx + ring):
+                        spans = [(lo, hi)]
+                    else:
+                        spans = [(iy, iy) for iy in (cy - ring, cy + ring) if 0 <= iy < ny]
+                    for a, b in spans:
+                        candidates = order[starts[ix * ny + a]:starts[ix * ny + b + 1]]
+                        if not len(candidates):
+                            continue
+                        d2 = (self.lat[candidates] - py) ** 2 + (self.lon[candidates] * scale - px) ** 2
+                        j = int(np.argmin(d2))
+                        if d2[j] < best_d2:
+                            best, best_d2 = int(candidates[j]), float(d2[j])
+            nodes[k] = best
+        snap_km = _distance_km(points[:, 0], points[:, 1], self.lat[nodes], self.lon[nodes])
+        return nodes, snap_km
+
+    def shortest_paths(self, source, targets=None):
+        # source からの最短時間 (秒) と、各ノードに至る最後の辺。targets が全て確定したら打ち切る
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.indices.tolist(), self.seconds.tolist())
+        indptr, indices, seconds = self._lists
+        dist = [math.inf] * self.num_nodes
+        last_edge = {}
+        dist[source] = 0.0
+        remaining = set(targets) if targets is not None else None
+        done = [False] * self.num_nodes
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            if remaining is not None:
+                remaining.discard(u)
+                if not remaining:
+                    break
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + seconds[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    last_edge[v] = e
+                    heapq.heappush(heap, (nd, v))
+        return dist, last_edge
+
+    def _csr_graph(self):
+        # scipy の疎行列にした道路グラフ (1回だけ作る)。
+        # 同じ2ノード間の辺が複数あると csr_matrix で合計されるので、最短の辺だけを残す
+        if self._csr is None:
+            from scipy.sparse import csr_matrix
+            edge_source = self.edge_source()
+            order = np.lexsort((self.seconds, self.indices, edge_source))
+            pairs = edge_source[order] * self.num_nodes + self.indices[order]
+            first = np.concatenate([[True], pairs[1:] != pairs[:-1]])
+            edges = order[first]
+            self._csr = csr_matrix((self.seconds[edges].astype(np.float64), (edge_source[edges], self.indices[edges])),
+                                   shape=(self.num_nodes, self.num_nodes))
+        return self._csr
+
+    def _many_to_many_seconds(self, sources, targets):
+        # sources × targets の最短時間 (秒)。scipy (requirements.txt) の C 実装の Dijkstra を使う。
+        # scipy がない環境では Python の Dijkstra で代用する (200 地点で約1秒かかる)
+        try:
+            from scipy.sparse.csgraph import dijkstra
+        except ImportError:
+            result = np.empty((len(sources), len(targets)))
+            for k, source in enumerate(sources):
+                dist, _ = self.shortest_paths(source, targets)
+                result[k] = [dist[t] for t in targets]
+            return result
+        graph = self._csr_graph()
+        result = np.empty((len(sources), len(targets)))
+        # 1回に全ノード分の距離 (出発地点数 × ノード数) を持つので、大きな道路網ではメモリを抑えるため分けて解く
+        for start in range(0, len(sources), DIJKSTRA_CHUNK):
+            chunk = sources[start:start + DIJKSTRA_CHUNK]
+            result[start:start + len(chunk)] = dijkstra(graph, directed=True, indices=chunk)[:, targets]
+        return result
+
+    def travel_time_matrix(self, locations, snap_speed_kmh=SNAP_SPEED_KMH):
+        # 地点間の移動時間 (分) = 最寄りノードまでの直線部分 + 道路網上の最短時間
+        nodes, snap_km = self.nearest_nodes(locations)
+        unique = sorted(set(nodes.tolist()))
+        position = {node: k for k, node in enumerate(unique)}
+        seconds = self._many_to_many_seconds(unique, unique)
+        index = [position[node] for node in nodes.tolist()]
+        road = seconds[np.ix_(index, index)] / 60
+        snap = snap_km / snap_speed_kmh * 60
+        minutes = road + snap[:, None] + snap[None, :]
+        minutes[~np.isfinite(minutes)] = UNREACHABLE_MINUTES
+        minutes = np.rint(np.minimum(minutes, UNREACHABLE_MINUTES))
+        np.fill_diagonal(minutes, 0)
+        return minutes.astype(np.int32)
+
+    def path_points(self, last_edge, source, target):
+        # shortest_paths の結果から source -> target の座標列を組み立てる
+        edge_source = self.edge_source()
+        edges = []
+        node = target
+        while node != source:
+            e = last_edge[node]
+            edges.append(e)
+            node = int(edge_source[e])
+        points = [(self.lat[source], self.lon[source])]
+        for e in reversed(edges):
+            start, end = self.geometry_ptr[e], self.geometry_ptr[e + 1]
+            points.extend(zip(self.geometry_lat[start:end], self.geometry_lon[start:end]))
+            points.append((self.lat[self.indices[e]], self.lon[self.indices[e]]))
+        return [(float(lat), float(lon)) for lat, lon in points]
+
+    def route_geometries(self, arcs):
+        # get_route_geometries と同じ形: {(出発座標, 到着座標): 道路に沿った座標列}
+        unique_arcs = list(dict.fromkeys((tuple(a), tuple(b)) for a, b in arcs))
+        geometries = {}
+        if not unique_arcs:
+            return geometries
+        points = [arc[0] for arc in unique_arcs] + [arc[1] for arc in unique_arcs]
+        nodes, _ = self.nearest_nodes(points)
+        starts, ends = nodes[:len(unique_arcs)].tolist(), nodes[len(unique_arcs):].tolist()
+        # 出発ノードごとに1回だけ探索する
+        by_source = {}
+        for arc, start, end in zip(unique_arcs, starts, ends):
+            by_source.setdefault(start, []).append((arc, end))
+        for start, items in by_source.items():
+            _, last_edge = self.shortest_paths(start, [end for _, end in items])
+            for arc, end in items:
+                if end == start or end in last_edge:
+                    road = self.path_points(last_edge, start, end) if end != start else []
+                    geometries[arc] = [arc[0]] + road + [arc[1]]
+                else:
+                    geometries[arc] = [arc[0], arc[1]]
+        return geometries
+
+
+def build_road_graph(path, bbox=None):
+    # .osm (XML) から RoadGraph を作る。bbox: (南, 西, 北, 東) の範囲内の道路だけを使う
+    if path.endswith('.pbf'):
+        raise ValueError("PBF 形式は読めません。osmium-tool 等で .osm (XML) に変換してください "
+                         "(例: osmium extract -b 西,南,東,北 region.osm.pbf -o region.osm)")
+    ways = read_osm_ways(path)
+    coords = read_osm_nodes(path, {ref for refs, _, _ in ways for ref in refs})
+
+    def inside(ref):
+        if ref not in coords:
+            return False
+        if bbox is None:
+            return True
+        lat, lon = coords[ref]
+        return bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]
+
+    # 範囲外・座標のないノードで way を区切る
+    pieces = []
+    for refs, speed, direction in ways:
+        run = []
+        for ref in refs + [None]:
+            if ref is not None and inside(ref):
+                run.append(ref)
+                continue
+            if len(run) >= 2:
+                pieces.append((run, speed, direction))
+            run = []
+
+    # 2本以上の道路が通るノードと道路の端点を交差点とし、その間を1本の辺にまとめる
+    uses = {}
+    for refs, _, _ in pieces:
+        for ref in refs:
+            uses[ref] = uses.get(ref, 0) + 1
+        uses[refs[0]] += 1
+        uses[refs[-1]] += 1
+    node_index = {}
+    lat, lon = [], []
+    sources, targets, seconds, geometries = [], [], [], []
+    for refs, speed, direction in pieces:
+        start, travelled, shape = refs[0], 0.0, []
+        for prev, ref in zip(refs[:-1], refs[1:]):
+            travelled += _segment_km(coords[prev], coords[ref]) / speed * 3600
+            if uses[ref] < 2:
+                shape.append(coords[ref])
+                continue
+            for node in (start, ref):
+                if node not in node_index:
+                    node_index[node] = len(lat)
+                    lat.append(coords[node][0])
+                    lon.append(coords[node][1])
+            if direction >= 0:
+                sources.append(node_index[start])
+                targets.append(node_index[ref])
+                seconds.append(travelled)
+                geometries.append(shape)
+            if direction <= 0:
+                sources.append(node_index[ref])
+                targets.append(node_index[start])
+                seconds.append(travelled)
+                geometries.append(shape[::-1])
+            start, travelled, shape = ref, 0.0, []
+
+    graph = RoadGraph.from_edges(lat, lon, sources, targets, seconds, geometries)
+    keep = _largest_strong_component(graph.num_nodes, graph.indptr.tolist(), graph.indices.tolist())
+    if not keep.all():
+        graph = graph.subgraph(keep)
+    print(f"道路グラフ: 道路 {len(ways)} 本 / ノード {graph.num_nodes} / 辺 {graph.num_edges} "
+          f"(形状点を含む元のノード {len(coords)}、行き来できない {int((~keep).sum())} ノードを除外)")
+    return graph
+
+
+_lock = threading.Lock()
+_graphs = {}  # (パス, 更新時刻) -> 読み込んだ RoadGraph
+
+
+def load_road_graph(path=ROAD_GRAPH_PATH):
+    # プロセス内で1回だけ読み込む (ファイルが更新されたら読み直す)
+    key = (path, os.path.getmtime(path))
+    with _lock:
+        graph = _graphs.get(key)
+        if graph is None:
+            graph = _graphs[key] = RoadGraph.load(path)
+        return graph
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="OpenStreetMap の .osm から道路グラフを作る")
+    parser.add_argument("osm", help="地域の .osm (XML) ファイル")
+    parser.add_argument("--out", default=ROAD_GRAPH_PATH, help="保存先 (.npz)")
+    parser.add_argument("--bbox", help="使う範囲 (南,西,北,東)")
+    args = parser.parse_args(argv)
+    bbox = tuple(float(v) for v in args.bbox.split(',')) if args.bbox else None
+    graph = build_road_graph(args.osm, bbox)
+    graph.save(args.out)
+    print(f"保存しました: {args.out} ({os.path.getsize(args.out) / 2**20:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main_cli(sys.argv[1:])
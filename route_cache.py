@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import sqlite3
+
+# ==========================================
+# 経路情報の永続キャッシュ (SQLite)
+# ==========================================
+
+CACHE_PATH = os.environ.get("ROUTE_CACHE_PATH", ".cache/route_cache.sqlite3")
+CACHE_TTL_SECONDS = 30 * 24 * 60 * 60  # 30日で期限切れ
+COORD_PRECISION = 5  # 小数点以下5桁 (約1m) で丸めてキーにする
+
+
+def coord_key(loc, precision=COORD_PRECISION):
+    return f"{round(float(loc[0]), precision):.{precision}f},{round(float(loc[1]), precision):.{precision}f}"
+
+
+class TravelTimeCache:
+    def __init__(self, path=CACHE_PATH, ttl_seconds=CACHE_TTL_SECONDS, precision=COORD_PRECISION):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS travel_times ("
+            " origin TEXT NOT NULL, destination TEXT NOT NULL, bucket TEXT NOT NULL,"
+            " minutes INTEGER NOT NULL, fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (origin, destination, bucket))"
+        )
+        self.conn.commit()
+        self.evict_expired()
+
+    def key(self, loc):
+        return coord_key(loc, self.precision)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        cur = self.conn.execute("DELETE FROM travel_times WHERE fetched_at < ?", (cutoff,))
+        self.conn.commit()
+        return cur.rowcount
+
+    def get_many(self, keys, bucket=""):
+        # keys に含まれる地点同士の組み合わせを一括取得 -> {(origin, destination): minutes}
+        found = {}
+        unique_keys = sorted(set(keys))
+        key_set = set(unique_keys)
+        cutoff = time.time() - self.ttl_seconds
+        chunk_size = 500  # SQLite の変数上限対策
+        for i in range(0, len(unique_keys), chunk_size):
+            chunk = unique_keys[i : i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT origin, destination, minutes FROM travel_times"
+                f" WHERE bucket = ? AND fetched_at >= ? AND origin IN ({placeholders})",
+                [bucket, cutoff] + chunk,
+            )
+            for origin, destination, minutes in rows:
+                if destination in key_set:
+                    found[(origin, destination)] = minutes
+        return found
+
+    def put_many(self, items, bucket=""):
+        # items: {(origin, destination): minutes}
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO travel_times (origin, destination, bucket, minutes, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            [(o, d, bucket, int(m), now) for (o, d), m in items.items()],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class RouteGeometryCache:
+    # 地図描画用の道路経路 (OSRM) を区間ごとに保存する。travel_times と同じファイルを使う
+    def __init__(self, path=CACHE_PATH, ttl_seconds=CACHE_TTL_SECONDS, precision=COORD_PRECISION):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS route_geometries ("
+            " origin TEXT NOT NULL, destination TEXT NOT NULL,"
+            " geometry TEXT NOT NULL, fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (origin, destination))"
+        )
+        self.conn.commit()
+        self.evict_expired()
+
+    def key(self, loc):
+        return coord_key(loc, self.precision)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        cur = self.conn.execute("DELETE FROM route_geometries WHERE fetched_at < ?", (cutoff,))
+        self.conn.commit()
+        return cur.rowcount
+
+    def get_many(self, pairs):
+        # pairs: [(origin_key, destination_key)] -> {(origin_key, destination_key): [(lat, lon), ...]}
+        found = {}
+        cutoff = time.time() - self.ttl_seconds
+        for origin, destination in set(pairs):
+            row = self.conn.execute(
+                "SELECT geometry FROM route_geometries WHERE origin = ? AND destination = ? AND fetched_at >= ?",
+                (origin, destination, cutoff),
+            ).fetchone()
+            if row:
+                found[(origin, destination)] = [tuple(point) for point in json.loads(row[0])]
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO route_geometries (origin, destination, geometry, fetched_at) VALUES (?, ?, ?, ?)",
+            [(o, d, json.dumps([[round(lat, 6), round(lon, 6)] for lat, lon in points]), now)
+             for (o, d), points in items.items()],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,151 @@
+import os
+import json
+import hashlib
+import threading
+
+# ==========================================
+# Google スプレッドシートとの通信 (認証の共有・まとめ読み・差分書き込み)
+# client には gspread.Client と同じ形のオブジェクト (テスト用の偽物など) も渡せる
+# ==========================================
+
+CREDENTIALS_PATH = os.environ.get("GOOGLE_CREDENTIALS_PATH", "credentials.json")
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+_lock = threading.Lock()
+_clients = {}  # 認証ファイル -> 認証済みクライアント
+_spreadsheets = {}  # (クライアント, スプレッドシートID) -> 開いたスプレッドシート
+_worksheets = {}  # (スプレッドシート, シート名) -> シート
+_header_columns = {}  # (スプレッドシートID, シート名) -> {列名: 列記号}
+_fingerprints = {}  # (スプレッドシートID, シート名) -> 前回読み込んだ内容のハッシュ
+
+
+def get_sheets_client(credentials_path=CREDENTIALS_PATH):
+    # credentials.json の読み込みと認証はプロセス内で1回だけ行う
+    with _lock:
+        client = _clients.get(credentials_path)
+        if client is None:
+            import gspread
+            from google.oauth2.service_account import Credentials
+            creds = Credentials.from_service_account_file(credentials_path, scopes=SCOPES)
+            client = _clients[credentials_path] = gspread.authorize(creds)
+        return client
+
+
+def open_spreadsheet(spreadsheet_id, client=None):
+    client = client or get_sheets_client()
+    with _lock:
+        spreadsheet = _spreadsheets.get((client, spreadsheet_id))
+    if spreadsheet is None:
+        spreadsheet = client.open_by_key(spreadsheet_id)
+        with _lock:
+            _spreadsheets[(client, spreadsheet_id)] = spreadsheet
+    return spreadsheet
+
+
+def open_worksheet(spreadsheet, title, create=False, rows=100, cols=20):
+    # create=True なら、シートが無い時に作る
+    with _lock:
+        worksheet = _worksheets.get((spreadsheet, title))
+    if worksheet is None:
+        try:
+            worksheet = spreadsheet.worksheet(title)
+        except Exception:
+            if not create:
+                raise
+            worksheet = spreadsheet.add_worksheet(title=title, rows=rows, cols=cols)
+        with _lock:
+            _worksheets[(spreadsheet, title)] = worksheet
+    return worksheet
+
+
+def reset():
+    # 認証切れなどの通信エラーの後は、次回に認証からやり直す
+    with _lock:
+        _clients.clear()
+        _spreadsheets.clear()
+        _worksheets.clear()
+        _header_columns.clear()
+
+
+def column_letter(index):
+    # 0始まりの列番号 -> "A", "B", ..., "AA"
+    letters = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _read_header(spreadsheet, sheet_name, columns):
+    response = spreadsheet.values_batch_get([f"'{sheet_name}'!1:1"])
+    rows = response['valueRanges'][0].get('values') or [[]]
+    return {name: column_letter(i) for i, name in enumerate(rows[0]) if name in columns}
+
+
+def read_columns(spreadsheet, spreadsheet_id, sheet_name, columns, required=()):
+    # 必要な列だけを1回の batchGet で読む -> [{列名: 値}] (見出し行を除く)
+    # 列の位置は見出し行から求めて覚えておき、見出しがずれていたら読み直す
+    key = (spreadsheet_id, sheet_name)
+    for attempt in range(2):
+        letters = _header_columns.get(key)
+        if letters is None:
+            letters = _read_header(spreadsheet, sheet_name, columns)
+            missing = [name for name in required if name not in letters]
+            if missing:
+                raise ValueError(f"シート '{sheet_name}' に列がありません: {', '.join(missing)}")
+            _header_columns[key] = letters
+        ranges = [f"'{sheet_name}'!{letter}:{letter}" for letter in letters.values()]
+        response = spreadsheet.values_batch_get(ranges, params={'majorDimension': 'COLUMNS'}) if ranges else {'valueRanges': []}
+        values = {}
+        for name, value_range in zip(letters, response['valueRanges']):
+            column = (value_range.get('values') or [[]])[0]
+            values[name] = column[1:] if column and column[0] == name else None
+        if all(column is not None for column in values.values()):
+            break
+        _header_columns.pop(key, None)
+    else:
+        raise ValueError(f"シート '{sheet_name}' の見出し行を読み取れません")
+
+    num_rows = max((len(column) for column in values.values()), default=0)
+    records = []
+    for row in range(num_rows):
+        record = {name: column[row] if row < len(column) else '' for name, column in values.items()}
+        # 途中の空行は読み飛ばす
+        if any(str(value).strip() for value in record.values()):
+            records.append(record)
+    return records
+
+
+def fingerprint_changed(spreadsheet_id, sheet_name, content):
+    # 前回読み込んだ時から内容が変わったか (初回は変更ありとする)
+    digest = hashlib.sha256(json.dumps(content, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+    key = (spreadsheet_id, sheet_name)
+    with _lock:
+        changed = _fingerprints.get(key) != digest
+        _fingerprints[key] = digest
+    return changed
+
+
+def diff_rows(current, new):
+    # シートの現在の値 current と書き込みたい値 new (どちらも文字列の2次元リスト) を比べ、
+    # 変わった行だけを連続する範囲ごとにまとめた batchUpdate 用のリストを返す
+    width = max([len(row) for row in current] + [len(row) for row in new] + [1])
+
+    def padded(rows, r):
+        row = rows[r] if r < len(rows) else []
+        return list(row) + [''] * (width - len(row))
+
+    updates = []
+    start = None
+    for r in range(max(len(current), len(new)) + 1):
+        changed = r < max(len(current), len(new)) and padded(current, r) != padded(new, r)
+        if changed and start is None:
+            start = r
+        elif not changed and start is not None:
+            updates.append({
+                'range': f"A{start + 1}:{column_letter(width - 1)}{r}",
+                'values': [padded(new, k) for k in range(start, r)],
+            })
+            start = None
+    return updates
@@ -0,0 +1,660 @@
+import os
+import json
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from data_source import set_vehicle_pool, format_minutes_to_time
+from telemetry import RunTelemetry
+
+# ==========================================
+# 1. ルーティングモデル構築
+# ==========================================
+
+def extract_routes(data, manager, routing, solution):
+    # 使用された車両ごとに [拠点, 訪問ノード..., 拠点] と各ノードの到着時刻を取り出す
+    routes = []
+    time_dimension = routing.GetDimensionOrDie('Time')
+    for vehicle_id in range(data['num_vehicles']):
+        index = routing.Start(vehicle_id)
+        if routing.IsEnd(solution.Value(routing.NextVar(index))):
+            continue
+        nodes, arrivals = [], []
+        while True:
+            nodes.append(manager.IndexToNode(index))
+            arrivals.append(solution.Min(time_dimension.CumulVar(index)))
+            if routing.IsEnd(index):
+                break
+            index = solution.Value(routing.NextVar(index))
+        routes.append({'vehicle_id': vehicle_id, 'nodes': nodes, 'arrivals': arrivals})
+    return routes
+
+def check_feasibility(data):
+    # 探索せずに分かる「明らかに解けない」条件を列挙する
+    problems = []
+    depot = data['depot']
+    total_demand = sum(data['demands'])
+    fleet_capacity = data['real_vehicle_count'] * data['capacity'] * data['max_trips']
+    if total_demand > fleet_capacity:
+        problems.append(
+            f"定員不足: 児童 {total_demand} 人 > {data['real_vehicle_count']} 台 × 定員 {data['capacity']} 人 × 最大 {data['max_trips']} 便")
+
+    start = data['time_windows'][depot][0]
+    for node in range(len(data['locations'])):
+        if node == depot:
+            continue
+        earliest = max(start + data['time_matrix'][depot][node], data['time_windows'][node][0])
+        deadline = data['time_windows'][node][1]
+        if earliest > deadline:
+            names = "・".join(data['names'][member] for member in data['node_members'][node])
+            problems.append(
+                f"期限に間に合わない: {names} (直行でも {format_minutes_to_time(earliest)} 着 / 期限 {format_minutes_to_time(deadline)})")
+    return problems
+
+# 実行可能解を素早く探す初期解戦略 (上から順に試す)。挿入系・SAVINGS は解けない場合もすぐに失敗を返す。
+# RELAXED_PROBE: 便の前後関係 (前の便の帰着後に次の便が出る) を外して挿入法で便を作り、
+# 後から便を車両に割り当て直す。挿入法が便の前後関係に阻まれて失敗する日でも解を見つけやすい
+RELAXED_PROBE = 'RELAXED_PARALLEL_CHEAPEST_INSERTION'
+PROBE_STRATEGIES = ['SAVINGS', 'PARALLEL_CHEAPEST_INSERTION', 'LOCAL_CHEAPEST_INSERTION', RELAXED_PROBE,
+                    'PATH_CHEAPEST_ARC']
+TURNOVER_MINUTES = 10  # 同じ車両の便と便の間に空ける時間
+
+def trip_finish(data, nodes, start):
+    # 拠点を start に出て nodes を順に回った時の帰着時刻。到着期限・拠点の受付時間に収まらなければ None
+    depot = data['depot']
+    t, previous = start, depot
+    for node in list(nodes) + [depot]:
+        t = max(t + data['time_matrix'][previous][node] + (data['service_time'] if previous != depot else 0),
+                data['time_windows'][node][0])
+        if t > data['time_windows'][node][1]:
+            return None
+        previous = node
+    return t
+
+def schedule_trips(data, trips_nodes):
+    # 便 (ノード列) を実際の車両に割り当て、車両ごとに前の便の帰着後に次の便が出るように並べる。
+    # 遅く出られない便から順に、間に合う車両のうち最も遅く空く車両へ入れる。
+    # 戻り値: 仮想車両ごとのノード列 (build_routing_model の車両番号順) / 割り当てられなければ None
+    depot = data['depot']
+    real_count, trips = data['real_vehicle_count'], data['trips']
+    opening, closing = data['time_windows'][depot]
+
+    def latest_start(nodes):
+        # 待ち時間を無視した、到着期限に間に合う最も遅い出発時刻 (割り当ての順番にだけ使う)
+        t, previous, latest = 0, depot, closing
+        for node in list(nodes) + [depot]:
+            t += data['time_matrix'][previous][node] + (data['service_time'] if previous != depot else 0)
+            latest = min(latest, data['time_windows'][node][1] - t)
+            previous = node
+        return latest
+
+    free_at = [opening] * real_count
+    assigned = [[] for _ in range(real_count)]
+    for nodes in sorted(trips_nodes, key=latest_start):
+        best = None
+        for car in range(real_count):
+            if len(assigned[car]) >= trips:
+                continue
+            start = free_at[car] + (TURNOVER_MINUTES if assigned[car] else 0)
+            finish = trip_finish(data, nodes, start)
+            if finish is not None and (best is None or free_at[car] > free_at[best[0]]):
+                best = (car, finish)
+        if best is None:
+            return None
+        car, finish = best
+        assigned[car].append(nodes)
+        free_at[car] = finish
+    routes = [[] for _ in range(data['num_vehicles'])]
+    for car, car_trips in enumerate(assigned):
+        for trip_id, nodes in enumerate(car_trips):
+            routes[trip_id * real_count + car] = list(nodes)
+    return routes
+
+def probe_relaxed_pool(data, manager, routing, probe_time_limit, cancel_event=None):
+    # RELAXED_PROBE: 便の前後関係を外したモデルで便を作り、schedule_trips で並べた初期解から解き直す
+    relaxed_manager, relaxed_routing = build_routing_model(data, turnover=False)
+    add_cancel_limit(relaxed_routing, cancel_event)
+    search_parameters = make_search_parameters('PARALLEL_CHEAPEST_INSERTION', time_limit=probe_time_limit)
+    search_parameters.solution_limit = 1
+    relaxed = relaxed_routing.SolveWithParameters(search_parameters)
+    if not relaxed:
+        return None
+    trips_nodes = [route['nodes'][1:-1] for route in extract_routes(data, relaxed_manager, relaxed_routing, relaxed)]
+    routes = schedule_trips(data, trips_nodes)
+    if routes is None:
+        return None
+    initial = routing.ReadAssignmentFromRoutes([[manager.NodeToIndex(node) for node in route] for route in routes], True)
+    if not initial:
+        return None
+    return routing.SolveFromAssignmentWithParameters(initial, search_parameters)
+
+def find_first_solution(data, probe_time_limit=5, telemetry=None, cancel_event=None):
+    # 最小の便数から始め、実行可能解が見つかるまで便数 (仮想車両) を増やす
+    # cancel_event がセットされたら探索中でも打ち切って None を返す
+    telemetry = telemetry or RunTelemetry()
+    for trips in range(data['min_trips'], data['max_trips'] + 1):
+        set_vehicle_pool(data, trips)
+        for strategy in PROBE_STRATEGIES:
+            if is_cancelled(cancel_event):
+                return None
+            with telemetry.phase('model_build'):
+                manager, routing = build_routing_model(data)
+                add_cancel_limit(routing, cancel_event)
+            with telemetry.phase('first_solution'):
+                if strategy == RELAXED_PROBE:
+                    solution = probe_relaxed_pool(data, manager, routing, probe_time_limit, cancel_event)
+                else:
+                    search_parameters = make_search_parameters(strategy, time_limit=probe_time_limit)
+                    search_parameters.solution_limit = 1
+                    solution = routing.SolveWithParameters(search_parameters)
+            telemetry.count('probes')
+            if solution:
+                print(f"{trips} 便 (仮想車両 {data['num_vehicles']} 台) で実行可能解を発見 ({strategy})")
+                telemetry.set_solver(trips=trips, vehicles=data['num_vehicles'], first_solution_strategy=strategy,
+                                     first_solution_objective=solution.ObjectiveValue())
+                return manager, routing, solution
+        print(f"{trips} 便では解が見つかりませんでした")
+    return None
+
+def build_transit_arrays(data):
+    # 走行時間 (コスト) 行列、乗降時間込みの時間行列、需要ベクトルを事前計算する
+    travel = np.asarray(data['time_matrix'], dtype=np.int64)
+    service = np.full(len(travel), data['service_time'], dtype=np.int64)
+    service[data['depot']] = 0
+    time_with_service = travel + service[:, None]
+    demands = np.asarray(data['demands'], dtype=np.int64)
+    return travel, time_with_service, demands
+
+def build_routing_model(data, transit='matrix', turnover=True):
+    # transit='matrix': 行列/ベクトルを C++ 側に登録し、探索中に Python を呼ばない
+    # transit='callback': 従来の Python コールバック (ベンチマーク比較用)
+    # turnover=False: 同じ車両の前の便の帰着後に次の便が出る制約を付けない (初期解の探索用)
+    manager = pywrapcp.RoutingIndexManager(len(data['time_matrix']), data['num_vehicles'], data['depot'])
+    routing = pywrapcp.RoutingModel(manager)
+    travel, time_with_service, demands = build_transit_arrays(data)
+
+    if transit == 'matrix':
+        transit_callback_index = routing.RegisterTransitMatrix(travel.tolist())
+        demand_callback_index = routing.RegisterUnaryTransitVector(demands.tolist())
+        total_time_callback_index = routing.RegisterTransitMatrix(time_with_service.tolist())
+    else:
+        travel_rows, time_rows, demand_list = travel.tolist(), time_with_service.tolist(), demands.tolist()
+
+        def time_callback(from_index, to_index):
+            return travel_rows[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+
+        def demand_callback(from_index):
+            return demand_list[manager.IndexToNode(from_index)]
+
+        def total_time_callback(from_index, to_index):
+            return time_rows[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+
+        transit_callback_index = routing.RegisterTransitCallback(time_callback)
+        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        total_time_callback_index = routing.RegisterTransitCallback(total_time_callback)
+
+    # コスト
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # 定員 (相乗りペナルティは削除しました)
+    routing.AddDimensionWithVehicleCapacity(demand_callback_index, 0, data['vehicle_capacities'], True, 'Capacity')
+
+    # 時間
+    routing.AddDimension(total_time_callback_index, 10000, 10000, False, 'Time')
+    time_dimension = routing.GetDimensionOrDie('Time')
+    
+    for i in range(len(data['time_matrix'])):
+        index = manager.NodeToIndex(i)
+        time_dimension.CumulVar(index).SetRange(data['time_windows'][i][0], data['time_windows'][i][1])
+
+    real_count = data['real_vehicle_count']
+    depot_window = data['time_windows'][data['depot']]
+    
+    for i in range(data['num_vehicles']):
+        start_index = routing.Start(i)
+        end_index = routing.End(i)
+        
+        time_dimension.CumulVar(start_index).SetRange(depot_window[0], depot_window[1])
+        time_dimension.CumulVar(end_index).SetRange(depot_window[0], depot_window[1])
+        
+        # 後ろ詰め（遅く出発）設定
+        routing.AddVariableMaximizedByFinalizer(time_dimension.CumulVar(start_index))
+
+        # 便が増えるごとにコスト加算 (1便目優先)
+        trip_index = i // real_count
+        fixed_cost = 1000 * trip_index 
+        routing.SetFixedCostOfVehicle(fixed_cost, i)
+
+    solver = routing.solver()
+    for v in range(real_count, data['num_vehicles'] if turnover else 0):
+        prev_v = v - real_count
+        prev_end_index = routing.End(prev_v)
+        curr_start_index = routing.Start(v)
+        solver.Add(time_dimension.CumulVar(curr_start_index) >= time_dimension.CumulVar(prev_end_index) + TURNOVER_MINUTES)
+    return manager, routing
+
+def make_search_parameters(strategy='PATH_CHEAPEST_ARC', metaheuristic=None, time_limit=60):
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, strategy)
+    if metaheuristic:
+        search_parameters.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+    search_parameters.time_limit.seconds = time_limit
+    return search_parameters
+
+# ==========================================
+# 2. 探索の中止
+# ==========================================
+
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+def add_cancel_limit(routing, cancel_event):
+    # 探索中は GIL を手放さないため、別スレッドから CancelSearch を呼んでも探索が終わるまで実行されない。
+    # 代わりに探索の制限として cancel_event を確認させ、解が見つからない間も打ち切れるようにする
+    if cancel_event is not None:
+        routing.AddSearchMonitor(routing.solver().CustomLimit(cancel_event.is_set))
+
+_worker_cancel_event = None  # spawn したワーカー内での中止の合図 (init_cancel_worker で設定)
+
+def init_cancel_worker(process_event):
+    # プロセス間の Event を探索中に毎回確認すると遅いので、スレッドでプロセス内の Event に写す
+    global _worker_cancel_event
+    _worker_cancel_event = threading.Event()
+
+    def forward():
+        process_event.wait()
+        _worker_cancel_event.set()
+    threading.Thread(target=forward, daemon=True).start()
+
+def worker_cancel_event():
+    return _worker_cancel_event
+
+@contextmanager
+def cancellable_process_pool(workers, cancel_event=None):
+    # Streamlit のスレッドを抱えたまま fork しないよう spawn でワーカーを起動する。
+    # cancel_event がセットされると、実行中のワーカーの探索を打ち切り (それまでの最良解を返す)、
+    # まだ始まっていないタスクはすぐに解なしで終わる
+    context = multiprocessing.get_context("spawn")
+    process_event = context.Event()
+    finished = threading.Event()
+
+    def forward():
+        while not finished.is_set():
+            if cancel_event.wait(0.2):
+                process_event.set()
+                return
+    if cancel_event is not None:
+        threading.Thread(target=forward, daemon=True).start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=init_cancel_worker, initargs=(process_event,)) as pool:
+            yield pool
+    finally:
+        finished.set()
+
+# ==========================================
+# 3. ポートフォリオ探索 (マルチコア)
+# ==========================================
+
+# (初期解の作り方, 局所探索のメタヒューリスティック) の組み合わせ。上から順にワーカーへ割り当てる
+PORTFOLIO = [
+    ('PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH'),
+    ('PARALLEL_CHEAPEST_INSERTION', 'GUIDED_LOCAL_SEARCH'),
+    ('SAVINGS', 'TABU_SEARCH'),
+    ('LOCAL_CHEAPEST_INSERTION', 'SIMULATED_ANNEALING'),
+    ('PATH_CHEAPEST_ARC', 'TABU_SEARCH'),
+    ('GLOBAL_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH'),
+    ('PATH_MOST_CONSTRAINED_ARC', 'SIMULATED_ANNEALING'),
+    ('CHRISTOFIDES', 'GENERIC_TABU_SEARCH'),
+]
+# PORTFOLIO より多くのプロセスを指定された時は、GUIDED_LOCAL_SEARCH の組み合わせを
+# 罰則の係数 (既定 0.1) を変えて繰り返す (探索パラメータに乱数の種はなく、同じ設定では同じ探索になるため)
+GLS_LAMBDA_VARIANTS = [0.05, 0.2, 0.3, 0.02, 0.5]
+PORTFOLIO_LOG_PATH = os.environ.get("PORTFOLIO_LOG_PATH", ".cache/portfolio_log.jsonl")
+
+def portfolio_mix(workers):
+    # [(初期解の作り方, メタヒューリスティック, GLS の係数 or None)] をプロセス数だけ返す (同じ組は作らない)
+    mix = [(strategy, metaheuristic, None) for strategy, metaheuristic in PORTFOLIO]
+    guided = [entry for entry in PORTFOLIO if entry[1] == 'GUIDED_LOCAL_SEARCH']
+    for coefficient in GLS_LAMBDA_VARIANTS:
+        mix.extend((strategy, metaheuristic, coefficient) for strategy, metaheuristic in guided)
+    return mix[:workers]
+
+def default_portfolio_workers():
+    # このプロセスが使えるコア数 (コンテナの CPU 制限を含む) と、重複しない組み合わせの数の小さい方
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # macOS / Windows
+        cores = os.cpu_count() or 1
+    return min(len(PORTFOLIO), cores)
+
+def run_portfolio_worker(data, strategy, metaheuristic, time_limit, lambda_coefficient=None):
+    # 別プロセスで1通りの探索を行い、結果はノード列として返す (Assignment はプロセス間で渡せないため)
+    started = time.monotonic()
+    manager, routing = build_routing_model(data)
+    add_cancel_limit(routing, worker_cancel_event())
+    history = []
+
+    def on_solution():
+        objective = routing.CostVar().Max()
+        if not history or objective < history[-1][1]:
+            history.append((round(time.monotonic() - started, 2), objective))
+    routing.AddAtSolutionCallback(on_solution)
+
+    search_parameters = make_search_parameters(strategy, metaheuristic, time_limit)
+    if lambda_coefficient is not None:
+        search_parameters.guided_local_search_lambda_coefficient = lambda_coefficient
+    solution = routing.SolveWithParameters(search_parameters)
+    return {
+        'strategy': strategy,
+        'metaheuristic': metaheuristic if lambda_coefficient is None else f"{metaheuristic}(λ={lambda_coefficient})",
+        'objective': solution.ObjectiveValue() if solution else None,
+        'routes': extract_routes(data, manager, routing, solution) if solution else None,
+        'history': history,
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+def solve_portfolio(data, time_limit=60, workers=None, cancel_event=None):
+    # workers: 省略時は default_portfolio_workers()。重複しない組み合わせの数を超える分は起動しない
+    mix = portfolio_mix(workers or default_portfolio_workers())
+    workers = len(mix)
+    print(f"ポートフォリオ探索: {workers} プロセスで並列に計算中 (各 {time_limit} 秒)...")
+
+    results = []
+    with cancellable_process_pool(workers, cancel_event) as pool:
+        futures = [pool.submit(run_portfolio_worker, data, strategy, meta, time_limit, coefficient)
+                   for strategy, meta, coefficient in mix]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"ポートフォリオのワーカーが失敗しました: {e}")
+
+    run_id = datetime.now().isoformat(timespec='seconds')
+    for result in results:
+        trace = ", ".join(f"{t}s:{obj}" for t, obj in result['history'])
+        print(f"  [{result['strategy']} + {result['metaheuristic']}] 目的値 {result['objective']} ({trace})")
+    try:
+        if os.path.dirname(PORTFOLIO_LOG_PATH):
+            os.makedirs(os.path.dirname(PORTFOLIO_LOG_PATH), exist_ok=True)
+        with open(PORTFOLIO_LOG_PATH, "a", encoding="utf-8") as f:
+            for result in results:
+                record = {key: value for key, value in result.items() if key != 'routes'}
+                record.update({'run': run_id, 'num_nodes': len(data['locations']), 'time_limit': time_limit})
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"ポートフォリオのログ保存に失敗しました: {e}")
+
+    solved = [result for result in results if result['objective'] is not None]
+    if not solved:
+        return None
+    best = min(solved, key=lambda result: result['objective'])
+    print(f"最良: {best['strategy']} + {best['metaheuristic']} (目的値 {best['objective']})")
+    return best
+
+# ==========================================
+# 4. 前回ルートからの再最適化
+# ==========================================
+
+LAST_SOLUTION_PATH = os.environ.get("LAST_SOLUTION_PATH", ".cache/last_solution.json")
+
+def save_last_solution(data, routes, path=LAST_SOLUTION_PATH):
+    # ノード番号は名簿が変わるとずれるため、児童名の並びとして車両ごとに保存する
+    payload = {
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+        'real_vehicle_count': data['real_vehicle_count'],
+        'routes': [
+            {
+                'vehicle_id': route['vehicle_id'],
+                'stops': [[data['names'][member] for member in data['node_members'][node]] for node in route['nodes'][1:-1]],
+            }
+            for route in routes
+        ],
+    }
+    try:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=1)
+    except OSError as e:
+        print(f"前回ルートの保存に失敗しました: {e}")
+
+def load_last_solution(path=LAST_SOLUTION_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def build_warm_start_routes(data, saved):
+    # 前回の車両ごとの訪問順から欠席者を除き、新しい児童を最安挿入して初期ルートを作る
+    depot = data['depot']
+    real_count = data['real_vehicle_count']
+    travel = data['time_matrix']
+    demands = data['demands']
+    capacities = data['vehicle_capacities']
+    node_of_name = {}
+    for node, members in enumerate(data['node_members']):
+        if node != depot:
+            for member in members:
+                node_of_name[data['names'][member]] = node
+
+    routes = [[] for _ in range(data['num_vehicles'])]
+    loads = [0] * data['num_vehicles']
+    assigned = set()
+    saved_real_count = saved.get('real_vehicle_count') or real_count
+    for saved_route in saved.get('routes', []):
+        # 台数が変わっても「車両k の 便t」として同じ車両に割り当てる
+        real_id = saved_route['vehicle_id'] % saved_real_count
+        trip_id = saved_route['vehicle_id'] // saved_real_count
+        vehicle_id = trip_id * real_count + real_id
+        if real_id >= real_count or vehicle_id >= data['num_vehicles']:
+            continue
+        for stop_names in saved_route['stops']:
+            for name in stop_names:
+                node = node_of_name.get(name)
+                if node is None or node in assigned:
+                    continue
+                if loads[vehicle_id] + demands[node] > capacities[vehicle_id]:
+                    continue
+                routes[vehicle_id].append(node)
+                loads[vehicle_id] += demands[node]
+                assigned.add(node)
+    kept = len(assigned)
+
+    inserted = 0
+    for node in range(len(data['locations'])):
+        if node == depot or node in assigned:
+            continue
+        best = None
+        for vehicle_id, route in enumerate(routes):
+            if loads[vehicle_id] + demands[node] > capacities[vehicle_id]:
+                continue
+            # 空の便を新たに使う場合は便の固定コストも加味する
+            opening_cost = 0 if route else 1000 * (vehicle_id // real_count)
+            path = [depot] + route + [depot]
+            for pos in range(len(path) - 1):
+                delta = travel[path[pos]][node] + travel[node][path[pos + 1]] - travel[path[pos]][path[pos + 1]] + opening_cost
+                if best is None or delta < best[0]:
+                    best = (delta, vehicle_id, pos)
+        if best is None:
+            continue
+        _, vehicle_id, pos = best
+        routes[vehicle_id].insert(pos, node)
+        loads[vehicle_id] += demands[node]
+        assigned.add(node)
+        inserted += 1
+    print(f"前回ルートを再利用: {kept} 地点を維持 / {inserted} 地点を新規挿入")
+    return routes
+
+# ==========================================
+# 5. 探索の実行
+# ==========================================
+
+VERIFY_ROUNDS = 2  # 推定値の区間を実際の移動時間に置き換えて解き直す最大回数
+
+def retime_routes(data, routes, arcs=None):
+    # 行列の今の値でルートの到着時刻を計算し直し、到着期限に遅れる (車両, ノード, 到着時刻) を返す
+    # arcs: 値が変わった区間。これを通るルートだけを計算し直す (省略時は全ルート)
+    depot, late = data['depot'], []
+    for route in routes:
+        legs = list(zip(route['nodes'][:-1], route['nodes'][1:]))
+        if arcs is not None and not any(leg in arcs for leg in legs):
+            continue
+        t = route['arrivals'][0]
+        arrivals = [t]
+        for a, b in legs:
+            t = max(t + data['time_matrix'][a][b] + (data['service_time'] if a != depot else 0), data['time_windows'][b][0])
+            arrivals.append(t)
+            if b != depot and t > data['time_windows'][b][1]:
+                late.append((route['vehicle_id'], b, t))
+        route['arrivals'] = arrivals
+    return late
+
+def solve_data_model(data, config, progress_callback=None, cancel_event=None, telemetry=None, fetch_options=None):
+    # progress_callback(目的値): 解が見つかるたびに呼ばれる (バックグラウンドジョブの進捗表示用)
+    # cancel_event: セットされると探索を打ち切る (それまでの最良解を返す。解がまだなければ None)
+    # telemetry: RunTelemetry を渡すと初期解までの時間・目的値の推移・分岐数などを記録する
+    # fetch_options: 推定値の区間を確かめる時に get_distance_matrix_batched へ渡す引数 (api_key / cache / fetcher)
+    # 戻り値: (目的値, 車両ごとのルート) / 解なしなら None
+    telemetry = telemetry or RunTelemetry()
+    result = _solve_data_model(data, config, progress_callback, cancel_event, telemetry)
+    if result is None or data.get('estimated_cells') is None:
+        return result
+
+    # 疎な行列の推定値で計画した区間は、実際の移動時間を取得して到着期限を確かめ直す。
+    # 遅れる地点があれば、その地点に出入りする区間をすべて取得し、残りの推定値も
+    # 確かめた区間の過小の比率で水増ししてから解き直す (新しいルートの推定値の区間も同様に確かめる)
+    from data_source import verify_estimated_arcs, pad_estimated_cells
+    fetch_options = fetch_options or {}
+    late = []
+    for attempt in range(VERIFY_ROUNDS + 1):
+        arcs = {leg for route in result[1] for leg in zip(route['nodes'][:-1], route['nodes'][1:])}
+        replaced = verify_estimated_arcs(data, arcs, telemetry=telemetry, **fetch_options)
+        late = retime_routes(data, result[1], replaced)
+        if not late or attempt == VERIFY_ROUNDS or is_cancelled(cancel_event):
+            break
+        print(f"実際の移動時間では {len(late)} 地点が到着期限に遅れるため、取得した値で解き直します")
+        nodes = range(len(data['locations']))
+        around = {arc for _, node, _ in late for other in nodes for arc in ((node, other), (other, node))}
+        verify_estimated_arcs(data, around, telemetry=telemetry, **fetch_options)
+        pad_estimated_cells(data)
+        retry_config = dict(config, time_limit=max(1, config.get('time_limit', 60) // 4))
+        resolved = _solve_data_model(data, retry_config, progress_callback, cancel_event, telemetry)
+        if resolved is None:
+            break
+        result = resolved
+    if late:
+        print(f"⚠️ 実際の移動時間では {len(late)} 地点が到着期限に遅れます:")
+        for vehicle_id, node, arrival in late[:10]:
+            names = "・".join(data['names'][member] for member in data['node_members'][node])
+            print(f"  {names}: {format_minutes_to_time(arrival)} 着 / 期限 {format_minutes_to_time(data['time_windows'][node][1])}")
+    telemetry.set_solver(verify_rounds=attempt, late_stops=len(late))
+    return result
+
+def _solve_data_model(data, config, progress_callback, cancel_event, telemetry):
+    started = time.monotonic()
+    with telemetry.phase('feasibility_check'):
+        problems = check_feasibility(data)
+    if problems:
+        print("⚠️ この条件では解けません:")
+        for problem in problems:
+            print(f"  {problem}")
+        telemetry.set_solver(status='infeasible', problems=problems)  # 画面に理由を表示するため文言ごと残す
+        return None
+
+    if data.get('decomposition'):
+        # 地域ごとに分割して解く。解けないクラスタがあれば分割せずに解き直す
+        from decomposition import solve_decomposed
+        with telemetry.phase('search'):
+            result = solve_decomposed(data, config, progress_callback, cancel_event, telemetry)
+        if result or is_cancelled(cancel_event):
+            return result
+        telemetry.set_solver(decomposition_fallback=True)
+        if data.get('partial_matrix'):
+            # 分割計算ではクラスタをまたぐ要素を取得していない (推定値) ので、全要素を取得してから解き直す
+            from data_source import complete_time_matrix
+            print("分割せずに解き直すため、残りの移動時間を取得します")
+            complete_time_matrix(data, config, telemetry=telemetry)
+
+    found = find_first_solution(data, config.get('probe_time_limit', 5), telemetry, cancel_event)
+    if not found and is_cancelled(cancel_event):
+        print("計算を中止しました (実行可能解が見つかる前に中止されました)")
+        telemetry.set_solver(status='cancelled')
+        return None
+    if not found:
+        print(f"⚠️ 最大 {data['max_trips']} 便でも解が見つかりませんでした")
+        telemetry.set_solver(status='no_solution', max_trips=data['max_trips'])
+        return None
+    manager, routing, first_solution = found
+    telemetry.set_solver(first_solution_s=round(time.monotonic() - started, 3))
+
+    # 改善した解だけを (開始からの秒数, 目的値) として残す
+    history = [(round(time.monotonic() - started, 3), first_solution.ObjectiveValue())]
+
+    def on_solution():
+        objective = routing.CostVar().Max()
+        if objective < history[-1][1]:
+            history.append((round(time.monotonic() - started, 3), objective))
+        if progress_callback:
+            progress_callback(objective)
+    routing.AddAtSolutionCallback(on_solution)
+    branches_before, failures_before = routing.solver().Branches(), routing.solver().Failures()
+
+    search_parameters = make_search_parameters('PATH_CHEAPEST_ARC', time_limit=config.get('time_limit', 60))
+
+    solution = None
+    if config.get('warm_start'):
+        saved = load_last_solution()
+        if saved:
+            initial_routes = build_warm_start_routes(data, saved)
+            initial = routing.ReadAssignmentFromRoutes(
+                [[manager.NodeToIndex(node) for node in route] for route in initial_routes], True)
+            if initial:
+                print("前回ルートを初期解として再最適化を実行中...")
+                search_parameters.time_limit.seconds = config.get('warm_start_time_limit', 10)
+                with telemetry.phase('search'):
+                    solution = routing.SolveFromAssignmentWithParameters(initial, search_parameters)
+                telemetry.set_solver(mode='warm_start')
+                search_parameters.time_limit.seconds = config.get('time_limit', 60)
+            else:
+                print("⚠️ 前回ルートは今回の条件では成立しないため、最初から計算します")
+        else:
+            print("前回ルートの記録がないため、最初から計算します")
+
+    if not solution and config.get('portfolio'):
+        with telemetry.phase('search'):
+            best = solve_portfolio(data, config.get('time_limit', 60), config.get('portfolio_workers'), cancel_event)
+        if best:
+            if progress_callback:
+                progress_callback(best['objective'])
+            # 各ワーカーの推移は探索開始からの秒数なので、初期解までの時間を足して揃える
+            offset = history[-1][0]
+            telemetry.set_solver(
+                mode='portfolio', status='solved', objective=best['objective'],
+                best_strategy=f"{best['strategy']} + {best['metaheuristic']}",
+                objective_history=history + [(round(offset + t, 3), obj) for t, obj in best['history']],
+            )
+            return best['objective'], best['routes']
+
+    if not solution:
+        print("最適化計算を実行中...")
+        with telemetry.phase('search'):
+            solution = routing.SolveFromAssignmentWithParameters(first_solution, search_parameters) or first_solution
+        telemetry.set_solver(mode='single')
+
+    solver = routing.solver()
+    telemetry.set_solver(
+        status='cancelled' if is_cancelled(cancel_event) else 'solved',
+        objective=solution.ObjectiveValue(),
+        objective_history=history,
+        search_branches=solver.Branches() - branches_before,
+        search_failures=solver.Failures() - failures_before,
+        solutions=solver.Solutions(),
+    )
+    return solution.ObjectiveValue(), extract_routes(data, manager, routing, solution)
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# ==========================================
+# 1回の計算の計測 (フェーズごとの時間・外部 API 呼び出し・探索の統計)
+# ==========================================
+
+TELEMETRY_LOG_PATH = os.environ.get("TELEMETRY_LOG_PATH", ".cache/telemetry.jsonl")
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class RunTelemetry:
+    def __init__(self, run_id=None):
+        self.run_id = run_id or datetime.now().isoformat(timespec='seconds')
+        self.started = time.monotonic()
+        self.ended = None
+        self.phases = {}  # フェーズ名 -> 秒 (同じフェーズは合計)
+        self.http = {}  # サービス名 -> {'latencies': [...], 'errors': n}
+        self.counters = {}  # 地点数・キャッシュヒット数など
+        self.solver = {}  # 初期解までの時間・目的値の推移・分岐数など
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - start)
+
+    def add_phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def record_http(self, service, seconds, ok=True):
+        with self.lock:
+            stats = self.http.setdefault(service, {'latencies': [], 'errors': 0})
+            stats['latencies'].append(seconds)
+            if not ok:
+                stats['errors'] += 1
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_solver(self, **values):
+        with self.lock:
+            self.solver.update(values)
+
+    def finish(self):
+        if self.ended is None:
+            self.ended = time.monotonic()
+
+    def to_dict(self):
+        with self.lock:
+            http = {}
+            for service, stats in self.http.items():
+                latencies = sorted(stats['latencies'])
+                http[service] = {
+                    'calls': len(latencies),
+                    'errors': stats['errors'],
+                    'total_s': round(sum(latencies), 3),
+                    'p50_s': round(_percentile(latencies, 0.5), 3),
+                    'p95_s': round(_percentile(latencies, 0.95), 3),
+                    'max_s': round(latencies[-1], 3),
+                }
+            return {
+                'run_id': self.run_id,
+                'wall_s': round((self.ended or time.monotonic()) - self.started, 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'http': http,
+                'counters': dict(self.counters),
+                'solver': dict(self.solver),
+            }
+
+    def save(self, path=TELEMETRY_LOG_PATH):
+        # 1回の計算 = 1行の JSON として追記する
+        self.finish()
+        try:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.to_dict(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"計測結果の保存に失敗しました: {e}")